@@ -1,56 +1,187 @@
+import functools
 import json
 import os
+import threading
+import uuid
+from collections import OrderedDict
 
 import dash
+import flask
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from dash import Input, Output, dcc, html
+from dash import (
+    ClientsideFunction,
+    Input,
+    Output,
+    State,
+    callback_context,
+    dcc,
+    html,
+)
 from dash.exceptions import PreventUpdate
 
+from utils.arrow_dataset import ArrowTaxiDataset
 from utils.bivariate_choropleth import (
     color_sets,
     conf_defaults,
-    create_bivariate_map,
-    join_taxi_with_pt_df,
+    count_tract_trips,
+    create_bivariate_map_skeleton,
+    get_mapbox_access_token,
+    get_tract_ids,
+    tract_value_arrays,
 )
+from utils.cache import ByteLRUCache, dataset_version
+from utils.compact import bytes_per_row, compact_taxi_df
+from utils.data_cube import TripCube, slider_range
 from utils.filtering import (
+    RANGE_FILTER_HEADERS,
+    IncrementalTaxiFilter,
     PaymentType,
     TaxiCoordType,
     Weekday,
-    filter_popular_times,
-    filter_taxi_df,
+    build_taxi_bitmap_index,
+    build_taxi_range_index,
+    filter_pickup_dates,
+    taxi_coord_headers,
 )
-from utils.utils import geo_dict, vectorize_popularity
+from utils.geojson import GEOJSON_LEVELS, level_for_zoom
+from utils.popular_times import PopularTimesTensor
+from utils.sampling import StratifiedTripSample
+from utils.startup import timed_load
+from utils.utils import get_geo_dict_levels
 
 # Set constants and access token
 DATA_ROOT = "./data/sample"
-
-# Note: Bad Practice! Should never commit the token.
-TOKEN_PATH = "./data/.mapbox_token"
-mapbox_access_token = open(TOKEN_PATH).read()
-px.set_mapbox_access_token(mapbox_access_token)
+# Store the taxi data with compact dtypes (categoricals, float32, int8/int16)
+COMPACT_TAXI_DATA = True
+# Memory budget of the cache of map results
+MAP_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Time in seconds the browser may reuse the tract GeoJSON before revalidating it
+MAP_GEOJSON_MAX_AGE = 24 * 60 * 60
+# Number of user sessions whose filter masks are kept for incremental filtering
+MAX_FILTER_SESSIONS = 16
+# Opt-in progressive rendering: show a map estimated from a stratified sample
+# of the trips first, then replace it with the exact map
+PROGRESSIVE_RENDERING = False
+TAXI_SAMPLE_FRACTION = 0.05
+# Backend of the taxi data: "memory" loads the CSV file into a DataFrame, and
+# "arrow" scans the Parquet dataset written by `python -m utils.arrow_dataset`
+# from disk on every query, for datasets that do not fit in memory
+TAXI_BACKEND = "memory"
+
+px.set_mapbox_access_token(get_mapbox_access_token())
 
 
 # Read main data
 taxi_data_path = os.path.join(DATA_ROOT, "sample_manhattan_taxi_2021_nov_final.csv")
+taxi_dataset_path = os.path.join(DATA_ROOT, "sample_manhattan_taxi_2021_nov_final")
 popular_times_data_path = os.path.join(DATA_ROOT, "sample_manhattan_popular_times.json")
 
-taxi = pd.read_csv(taxi_data_path, engine="pyarrow")
-popular_times = pd.read_json(popular_times_data_path)
+if TAXI_BACKEND == "arrow":
+    assert (
+        not PROGRESSIVE_RENDERING
+    ), "[ERROR] Progressive rendering needs the taxi data in memory."
+    with timed_load("taxi"):
+        taxi_dataset = ArrowTaxiDataset(taxi_dataset_path)
+        taxi_data_paths = [taxi_dataset_path]
+        taxi_slider_ranges = {
+            header: slider_range(taxi_dataset.column_range(header))
+            for header in RANGE_FILTER_HEADERS
+        }
+        taxi_payment_types = taxi_dataset.unique_values("payment_type")
+        taxi_date_range = taxi_dataset.date_range()
+else:
+    with timed_load("taxi"):
+        taxi = pd.read_csv(taxi_data_path, engine="pyarrow")
+
+        taxi["pickup_datetime"] = pd.to_datetime(taxi["pickup_datetime"])
+        taxi["dropoff_datetime"] = pd.to_datetime(taxi["dropoff_datetime"])
+
+        taxi["pickup_weekday"] = taxi["pickup_datetime"].dt.weekday
+        taxi["dropoff_weekday"] = taxi["dropoff_datetime"].dt.weekday
+        taxi["pickup_hour"] = taxi["pickup_datetime"].dt.hour
+        taxi["dropoff_hour"] = taxi["dropoff_datetime"].dt.hour
+
+        taxi_date_range = [
+            taxi["pickup_datetime"].min().strftime("%Y-%m-%d"),
+            taxi["pickup_datetime"].max().strftime("%Y-%m-%d"),
+        ]
+
+        if COMPACT_TAXI_DATA:
+            original_bytes_per_row = bytes_per_row(taxi)
+            taxi = compact_taxi_df(taxi)
+            print(
+                "[INFO] Compacted taxi data from {:.1f} to {:.1f} bytes per row.".format(
+                    original_bytes_per_row, bytes_per_row(taxi)
+                )
+            )
+
+    with timed_load("taxi_bitmap_index"):
+        taxi_bitmap_index = build_taxi_bitmap_index(taxi)
+
+    with timed_load("taxi_range_index"):
+        taxi_range_index = build_taxi_range_index(taxi)
+
+    with timed_load("taxi_cube"):
+        taxi_cube = TripCube(taxi)
+
+    taxi_data_paths = [taxi_data_path]
+    taxi_slider_ranges = {
+        header: slider_range(taxi[header]) for header in RANGE_FILTER_HEADERS
+    }
+    taxi_payment_types = sorted(list(taxi["payment_type"].unique()))
+
+if PROGRESSIVE_RENDERING:
+    with timed_load("taxi_sample"):
+        taxi_sample = StratifiedTripSample(taxi, TAXI_SAMPLE_FRACTION)
+
+with timed_load("popular_times"):
+    popular_times = PopularTimesTensor(pd.read_json(popular_times_data_path))
+
+print("[DEBUG] app.py: Finished loading main data.")
 
-# Setting column name as `pt_vec_orig` in case of overwriting the columns during filtering
-popular_times["pt_vec_orig"] = popular_times["populartimes"].apply(vectorize_popularity)
+# Cache of {normalized filters: per-tract values}, emptied whenever the
+# data files the app loaded change, see `refresh_map_cache`
+map_cache = ByteLRUCache(MAP_CACHE_MAX_BYTES)
+map_cache.invalidate(dataset_version(*taxi_data_paths, popular_times_data_path))
 
-taxi["pickup_datetime"] = pd.to_datetime(taxi["pickup_datetime"])
-taxi["dropoff_datetime"] = pd.to_datetime(taxi["dropoff_datetime"])
 
-taxi["pickup_weekday"] = taxi["pickup_datetime"].dt.weekday
-taxi["dropoff_weekday"] = taxi["dropoff_datetime"].dt.weekday
-taxi["pickup_hour"] = taxi["pickup_datetime"].dt.hour
-taxi["dropoff_hour"] = taxi["dropoff_datetime"].dt.hour
+def refresh_map_cache():
+    """Empties `map_cache` if the data files changed since its entries were
+    computed. The arrow backend reads the taxi data from disk on every query,
+    so its dataset is reopened to find the rewritten partitions."""
+    global taxi_dataset
+
+    version = dataset_version(*taxi_data_paths, popular_times_data_path)
+    if version == map_cache.version:
+        return
+
+    print("[INFO] Data files changed, emptying the map cache.")
+    if TAXI_BACKEND == "arrow":
+        taxi_dataset = ArrowTaxiDataset(taxi_dataset_path)
+    map_cache.invalidate(version)
+
+
+# Incremental taxi filters of the most recent user sessions: {session_id: filter},
+# shared by the threads of the server
+filter_sessions = OrderedDict()
+filter_sessions_lock = threading.Lock()
+
+
+def get_session_filter(session_id):
+    """Returns the incremental taxi filter of a session, creating it if needed"""
+    with filter_sessions_lock:
+        if session_id not in filter_sessions:
+            filter_sessions[session_id] = IncrementalTaxiFilter(
+                taxi, taxi_bitmap_index, taxi_range_index
+            )
+            if len(filter_sessions) > MAX_FILTER_SESSIONS:
+                filter_sessions.popitem(last=False)
+        filter_sessions.move_to_end(session_id)
+        return filter_sessions[session_id]
 
-print("[DEBUG] app.py: Finished loading main data.")
 
 # Load conf defaults
 cholopleth_config = conf_defaults()
@@ -146,12 +277,9 @@ app.layout = html.Div(
                                     [
                                         html.P("Trip Distance"),
                                         dcc.RangeSlider(
-                                            min=taxi["trip_distance"].min(),
-                                            max=taxi["trip_distance"].max(),
-                                            value=[
-                                                taxi["trip_distance"].min(),
-                                                taxi["trip_distance"].max(),
-                                            ],
+                                            min=taxi_slider_ranges["trip_distance"][0],
+                                            max=taxi_slider_ranges["trip_distance"][1],
+                                            value=taxi_slider_ranges["trip_distance"],
                                             tooltip={
                                                 "placement": "bottom",
                                                 "always_visible": True,
@@ -166,12 +294,9 @@ app.layout = html.Div(
                                     [
                                         html.P("Fare Amount"),
                                         dcc.RangeSlider(
-                                            min=taxi["fare_amount"].min(),
-                                            max=taxi["fare_amount"].max(),
-                                            value=[
-                                                taxi["fare_amount"].min(),
-                                                taxi["fare_amount"].max(),
-                                            ],
+                                            min=taxi_slider_ranges["fare_amount"][0],
+                                            max=taxi_slider_ranges["fare_amount"][1],
+                                            value=taxi_slider_ranges["fare_amount"],
                                             tooltip={
                                                 "placement": "bottom",
                                                 "always_visible": True,
@@ -186,12 +311,9 @@ app.layout = html.Div(
                                     [
                                         html.P("Tip Amount"),
                                         dcc.RangeSlider(
-                                            min=taxi["tip_amount"].min(),
-                                            max=taxi["tip_amount"].max(),
-                                            value=[
-                                                taxi["tip_amount"].min(),
-                                                taxi["tip_amount"].max(),
-                                            ],
+                                            min=taxi_slider_ranges["tip_amount"][0],
+                                            max=taxi_slider_ranges["tip_amount"][1],
+                                            value=taxi_slider_ranges["tip_amount"],
                                             tooltip={
                                                 "placement": "bottom",
                                                 "always_visible": True,
@@ -206,12 +328,9 @@ app.layout = html.Div(
                                     [
                                         html.P("Total Amount"),
                                         dcc.RangeSlider(
-                                            min=taxi["total_amount"].min(),
-                                            max=taxi["total_amount"].max(),
-                                            value=[
-                                                taxi["total_amount"].min(),
-                                                taxi["total_amount"].max(),
-                                            ],
+                                            min=taxi_slider_ranges["total_amount"][0],
+                                            max=taxi_slider_ranges["total_amount"][1],
+                                            value=taxi_slider_ranges["total_amount"],
                                             tooltip={
                                                 "placement": "bottom",
                                                 "always_visible": True,
@@ -226,19 +345,29 @@ app.layout = html.Div(
                                     [
                                         html.P("Payment Type"),
                                         dcc.Dropdown(
-                                            options=sorted(
-                                                list(taxi["payment_type"].unique())
-                                            ),
+                                            options=taxi_payment_types,
                                             multi=True,
-                                            value=sorted(
-                                                list(taxi["payment_type"].unique())
-                                            ),
+                                            value=taxi_payment_types,
                                             id="payment-type",
                                         ),
                                     ],
                                     id="payment-type-container",
                                 ),
                                 html.Hr(),
+                                html.Div(
+                                    [
+                                        html.P("Pickup Date"),
+                                        dcc.DatePickerRange(
+                                            min_date_allowed=taxi_date_range[0],
+                                            max_date_allowed=taxi_date_range[1],
+                                            start_date=taxi_date_range[0],
+                                            end_date=taxi_date_range[1],
+                                            id="pickup-date",
+                                        ),
+                                    ],
+                                    id="pickup-date-container",
+                                ),
+                                html.Hr(),
                                 html.Div(
                                     [
                                         html.P("Day of the Week"),
@@ -282,7 +411,13 @@ app.layout = html.Div(
                                     id="figure1",
                                     figure=blank_fig(),
                                     config=blank_config,
-                                )
+                                ),
+                                dcc.Store(id="figure1-geojson-level"),
+                                dcc.Store(id="figure1-patch"),
+                                dcc.Store(id="filter-session", storage_type="session"),
+                                dcc.Store(id="figure1-approximate"),
+                                dcc.Store(id="figure1-exact"),
+                                dcc.Store(id="figure1-pending"),
                             ],
                             id="map1-fig",
                         ),
@@ -368,20 +503,7 @@ app.layout = html.Div(
 )
 
 
-@app.callback(
-    Output("figure1", "figure"),
-    [
-        Input("taxi-coord-type", "value"),
-        Input("trip-distance", "value"),
-        Input("fare-amount", "value"),
-        Input("tip-amount", "value"),
-        Input("total-amount", "value"),
-        Input("payment-type", "value"),
-        Input("weekday", "value"),
-        Input("hour", "value"),
-    ],
-)
-def update_map1(
+def parse_map1_filters(
     taxi_coord_type,
     trip_distance,
     fare_amount,
@@ -391,7 +513,9 @@ def update_map1(
     weekday,
     hour,
 ):
-    if (
+    """Converts the values of the filter components to the arguments of the
+    taxi filters, or returns None if a filter is empty"""
+    if not (
         trip_distance
         and fare_amount
         and tip_amount
@@ -400,44 +524,339 @@ def update_map1(
         and weekday
         and hour
     ):
-        if type(payment_type) != list:
-            payment_type = [payment_type]
-        if type(weekday) != list:
-            weekday = [weekday]
-        if type(hour) != list:
-            hour = [hour]
-
-        taxi_coord_type = TaxiCoordType[taxi_coord_type.upper()]
-        payment_type = [PaymentType[s.replace(" ", "").upper()] for s in payment_type]
-        weekday = [Weekday[s.upper()] for s in weekday]
-        hour = list(range(hour[0], hour[1]))
-
-        taxi_filtered = filter_taxi_df(
-            taxi,
-            taxi_coord_type,
-            trip_distance,
-            fare_amount,
-            tip_amount,
-            total_amount,
-            payment_type,
-            weekday,
-            hour,
+        return None
+
+    if type(payment_type) != list:
+        payment_type = [payment_type]
+    if type(weekday) != list:
+        weekday = [weekday]
+    if type(hour) != list:
+        hour = [hour]
+
+    taxi_coord_type = TaxiCoordType[taxi_coord_type.upper()]
+    payment_type = [PaymentType[s.replace(" ", "").upper()] for s in payment_type]
+    weekday = [Weekday[s.upper()] for s in weekday]
+    hour = list(range(hour[0], hour[1]))
+
+    return (
+        taxi_coord_type,
+        trip_distance,
+        fare_amount,
+        tip_amount,
+        total_amount,
+        payment_type,
+        weekday,
+        hour,
+    )
+
+
+def parse_date_range(start_date, end_date):
+    """Converts the dates of the date picker to the pickup `date_range` of the
+    taxi filters, or returns None if they cover all the trips"""
+    start_date = max((start_date or taxi_date_range[0])[:10], taxi_date_range[0])
+    end_date = min((end_date or taxi_date_range[1])[:10], taxi_date_range[1])
+    if [start_date, end_date] == taxi_date_range:
+        return None
+    return [start_date, end_date]
+
+
+def map1_cache_key(filters, date_range):
+    """Returns the key of a map in `map_cache` from its normalized filters"""
+    (
+        taxi_coord_type,
+        trip_distance,
+        fare_amount,
+        tip_amount,
+        total_amount,
+        payment_type,
+        weekday,
+        hour,
+    ) = filters
+    return (
+        taxi_coord_type.name,
+        tuple(float(x) for x in trip_distance),
+        tuple(float(x) for x in fare_amount),
+        tuple(float(x) for x in tip_amount),
+        tuple(float(x) for x in total_amount),
+        tuple(sorted(t.name for t in payment_type)),
+        tuple(sorted(d.value for d in weekday)),
+        tuple(hour),
+        tuple(date_range or ()),
+    )
+
+
+def map1_geojson_url(geojson_level):
+    """Returns the URL of the tract GeoJSON at a level of detail, see
+    `serve_map1_geojson`"""
+    return app.get_relative_path("/map1/geojson/{}.json".format(geojson_level))
+
+
+@functools.lru_cache(maxsize=None)
+def map1_geojson_body(geojson_level):
+    """Returns the tract GeoJSON at a level of detail serialized to JSON"""
+    return json.dumps(get_geo_dict_levels()[geojson_level], separators=(",", ":"))
+
+
+@server.route("/map1/geojson/<int:geojson_level>.json")
+def serve_map1_geojson(geojson_level):
+    """Serves the tract GeoJSON at a level of detail, fetched by the browser
+    from the URL of the map trace and cached like a static asset"""
+    if geojson_level >= len(GEOJSON_LEVELS):
+        flask.abort(404)
+
+    response = flask.Response(
+        map1_geojson_body(geojson_level), mimetype="application/json"
+    )
+    response.cache_control.public = True
+    response.cache_control.max_age = MAP_GEOJSON_MAX_AGE
+    response.add_etag()
+    return response.make_conditional(flask.request)
+
+
+@functools.lru_cache(maxsize=None)
+def map1_skeleton():
+    """Returns the static part of the map, without the tract geometry which
+    is fetched from the URL set by `map1_patch`, built once"""
+    fig = create_bivariate_map_skeleton(
+        color_sets["pink-blue"],
+        map1_geojson_url(0),
+        get_tract_ids(),
+        conf=cholopleth_config,
+    )
+    return fig.to_plotly_json()
+
+
+def map1_values(tract_counts, popularity):
+    """Returns the per-tract values recolored in the browser, as compact lists
+    aligned with `get_tract_ids`: the trip counts and the popularity"""
+    return {
+        "taxi": np.asarray(tract_counts).astype(np.int64).tolist(),
+        "popularity": np.asarray(popularity, dtype=float).tolist(),
+    }
+
+
+def map1_patch(key, geojson_level, values, send_skeleton, note=None):
+    """Returns the update of the map applied in the browser by
+    `assets/map1.js`, which classifies the tracts from their `values` (see
+    `map1_values`) and recolors them. The GeoJSON URL of `geojson_level` is
+    set on the trace, and the skeleton of the map is only sent if the browser
+    does not have it yet. In progressive mode, the annotations are replaced
+    too, to show or clear the `note`."""
+    patch = {
+        "key": key,
+        "skeleton": map1_skeleton() if send_skeleton else None,
+        "geojson": map1_geojson_url(geojson_level),
+        "values": values,
+        "layout": dict(),
+    }
+    if PROGRESSIVE_RENDERING:
+        annotations = list(map1_skeleton()["layout"]["annotations"])
+        if note is not None:
+            annotations.append(
+                dict(
+                    text=note,
+                    xref="paper",
+                    yref="paper",
+                    x=0.01,
+                    y=0.99,
+                    xanchor="left",
+                    yanchor="top",
+                    showarrow=False,
+                    bgcolor="white",
+                )
+            )
+        patch["layout"]["annotations"] = annotations
+    return patch
+
+
+def render_map1(filters, date_range, session_id):
+    """Returns the per-tract values of the exact bivariate map of the taxi
+    trips selected by `filters` and picked up in `date_range`, see
+    `map1_values`"""
+    taxi_coord_type, weekday, hour = filters[0], filters[6], filters[7]
+    cache_key = map1_cache_key(filters, date_range)
+    refresh_map_cache()
+    values = map_cache.get(cache_key)
+    if values is not None:
+        print("[DEBUG] Map cache hit: {}".format(map_cache.stats()))
+        return values
+
+    print("[DEBUG] Map cache miss: {}".format(map_cache.stats()))
+
+    # Count the trips streamed from disk with the arrow backend. Otherwise,
+    # answer from the pre-aggregated cube, or scan the trips if a slider range
+    # does not line up with the bins of the cube or if only some days are
+    # selected
+    if TAXI_BACKEND == "arrow":
+        tract_counts = taxi_dataset.tract_counts(*filters, date_range=date_range)
+    elif date_range is None:
+        tract_counts = taxi_cube.tract_counts(*filters)
+    else:
+        tract_counts = None
+    if tract_counts is None:
+        taxi_filtered = get_session_filter(session_id).indices(*filters)
+        taxi_filtered = filter_pickup_dates(taxi, taxi_filtered, date_range)
+        census_tract_idx = taxi[
+            taxi_coord_headers(taxi_coord_type)["census_tract_idx"]
+        ].to_numpy()
+        tract_counts = count_tract_trips(
+            census_tract_idx[taxi_filtered], get_tract_ids()
         )
 
-        print("[DEBUG] Finished filtering taxi data.")
+    print("[DEBUG] Finished filtering taxi data.")
+
+    tract_popularity = popular_times.tract_popularity(weekday, hour)
+
+    print("[DEBUG] Finished filtering popular times data.")
 
-        popular_times_filtered = filter_popular_times(popular_times, weekday, hour)
+    values = map1_values(*tract_value_arrays(tract_counts, tract_popularity))
+    map_cache.put(cache_key, values)
+    return values
 
-        print("[DEBUG] Finished filtering popular times data.")
 
-        joined_df = join_taxi_with_pt_df(taxi_filtered, popular_times_filtered)
-        fig = create_bivariate_map(
-            joined_df, color_sets["pink-blue"], geo_dict, conf=cholopleth_config
+def render_map1_approximate(filters, date_range):
+    """Returns the per-tract values of the bivariate map of the taxi trips
+    selected by `filters` and picked up in `date_range`, with trip counts
+    estimated from `taxi_sample`"""
+    weekday, hour = filters[6], filters[7]
+    return map1_values(
+        *tract_value_arrays(
+            taxi_sample.tract_counts(*filters, date_range=date_range),
+            popular_times.tract_popularity(weekday, hour),
         )
+    )
 
-        return fig
-    else:
+
+# The map is recolored in the browser from the updates of `map1_patch`.
+# In progressive mode, they go through the stores read by `map1.select_patch`,
+# which applies the approximate update then the exact one
+if PROGRESSIVE_RENDERING:
+    MAP1_PATCH_OUTPUT = Output("figure1-approximate", "data")
+else:
+    MAP1_PATCH_OUTPUT = Output("figure1-patch", "data")
+
+
+@app.callback(
+    [
+        MAP1_PATCH_OUTPUT,
+        Output("figure1-geojson-level", "data"),
+        Output("filter-session", "data"),
+        Output("figure1-pending", "data"),
+    ],
+    [
+        Input("taxi-coord-type", "value"),
+        Input("trip-distance", "value"),
+        Input("fare-amount", "value"),
+        Input("tip-amount", "value"),
+        Input("total-amount", "value"),
+        Input("payment-type", "value"),
+        Input("weekday", "value"),
+        Input("hour", "value"),
+        Input("pickup-date", "start_date"),
+        Input("pickup-date", "end_date"),
+        Input("figure1", "relayoutData"),
+    ],
+    State("figure1-geojson-level", "data"),
+    State("filter-session", "data"),
+)
+def update_map1(
+    taxi_coord_type,
+    trip_distance,
+    fare_amount,
+    tip_amount,
+    total_amount,
+    payment_type,
+    weekday,
+    hour,
+    start_date,
+    end_date,
+    relayout_data,
+    geojson_level,
+    session_id,
+):
+    # Pick the level of detail of the tract GeoJSON for the current zoom, and
+    # only redraw on zooming when the level changes. The skeleton of the map
+    # is only sent with the first map of the page.
+    zoom = (relayout_data or {}).get("mapbox.zoom")
+    send_skeleton = geojson_level is None
+    if callback_context.triggered_id == "figure1":
+        if zoom is None or level_for_zoom(zoom) == geojson_level:
+            raise PreventUpdate
+        geojson_level = level_for_zoom(zoom)
+    elif geojson_level is None:
+        geojson_level = level_for_zoom(zoom)
+
+    inputs = [
+        taxi_coord_type,
+        trip_distance,
+        fare_amount,
+        tip_amount,
+        total_amount,
+        payment_type,
+        weekday,
+        hour,
+    ]
+    filters = parse_map1_filters(*inputs)
+    if filters is None:
         raise PreventUpdate
+    date_range = parse_date_range(start_date, end_date)
+
+    if session_id is None:
+        session_id = uuid.uuid4().hex
+
+    cache_key = map1_cache_key(filters, date_range)
+    key = json.dumps(cache_key)
+    refresh_map_cache()
+    if not PROGRESSIVE_RENDERING or cache_key in map_cache:
+        values = render_map1(filters, date_range, session_id)
+        patch = map1_patch(key, geojson_level, values, send_skeleton)
+        return patch, geojson_level, session_id, dash.no_update
+
+    # Answer right away from the sample, and let `complete_map1` replace the
+    # map with the exact one, unless the exact one is already cached
+    values = render_map1_approximate(filters, date_range)
+    note = "Approximate: estimated from a {:.0%} sample, refining...".format(
+        taxi_sample.fraction
+    )
+    patch = map1_patch(key, geojson_level, values, send_skeleton, note)
+    pending = {
+        "key": key,
+        "inputs": inputs,
+        "date_range": date_range,
+        "geojson_level": geojson_level,
+        "session_id": session_id,
+    }
+    return patch, geojson_level, session_id, pending
+
+
+if PROGRESSIVE_RENDERING:
+
+    @app.callback(
+        Output("figure1-exact", "data"),
+        Input("figure1-pending", "data"),
+    )
+    def complete_map1(pending):
+        if not pending:
+            raise PreventUpdate
+
+        filters = parse_map1_filters(*pending["inputs"])
+        values = render_map1(filters, pending["date_range"], pending["session_id"])
+        return map1_patch(pending["key"], pending["geojson_level"], values, False)
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="map1", function_name="select_patch"),
+        Output("figure1", "figure"),
+        Input("figure1-approximate", "data"),
+        Input("figure1-exact", "data"),
+        State("figure1", "figure"),
+    )
+else:
+    app.clientside_callback(
+        ClientsideFunction(namespace="map1", function_name="apply_patch"),
+        Output("figure1", "figure"),
+        Input("figure1-patch", "data"),
+        State("figure1", "figure"),
+    )
 
 
 if __name__ == "__main__":
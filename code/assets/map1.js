@@ -0,0 +1,84 @@
+// Clientside callbacks of the bivariate map, recoloring the census tracts from
+// the per-tract values sent by the `update_map1` and `complete_map1` callbacks
+// of app.py. The tract GeoJSON is fetched once per level of detail from the
+// URL set on the trace, and cached by the browser.
+
+// Returns the percentile `q` of `values` with the linear interpolation of
+// `np.percentile`
+function percentile(values, q) {
+    const sorted = Float64Array.from(values).sort();
+    const index = (sorted.length - 1) * (q / 100);
+    const below = Math.floor(index);
+    const above = Math.min(below + 1, sorted.length - 1);
+    const t = index - below;
+    const diff = sorted[above] - sorted[below];
+    return t >= 0.5 ? sorted[above] - diff * (1 - t) : sorted[below] + diff * t;
+}
+
+// Returns the bins (0, 1, 2) of `values` split at percentiles 33 and 66,
+// upper breaks included
+function terciles(values) {
+    const low = percentile(values, 33);
+    const high = percentile(values, 66);
+    return values.map((value) => (value <= low ? 0 : value <= high ? 1 : 2));
+}
+
+// Same as `bivariate_classes` of utils/bivariate_choropleth.py: the position
+// (0 to 8) of every x/y value pair in the 9-color matrix of bivariate colors
+function bivariateClasses(x, y) {
+    const xBins = terciles(x);
+    const yBins = terciles(y);
+    return xBins.map((xBin, i) => xBin + 3 * yBins[i]);
+}
+
+// Returns the figure recolored from the values of a patch, built on the
+// skeleton sent with the patch or else on the current figure, or null if
+// the current figure is not the map yet
+function applyMap1Patch(patch, figure) {
+    let base = patch.skeleton;
+    if (!base) {
+        if (!figure || !figure.data.length || figure.data[0].type !== "choroplethmapbox") {
+            return null;
+        }
+        base = figure;
+    }
+    const trace = base.data[0];
+    const taxi = patch.values.taxi;
+    const popularity = patch.values.popularity;
+    return {
+        data: [
+            Object.assign({}, trace, {
+                geojson: patch.geojson,
+                z: bivariateClasses(taxi, popularity),
+                customdata: trace.locations.map((id, i) => [id, taxi[i], popularity[i]]),
+            }),
+        ],
+        layout: Object.assign({}, base.layout, patch.layout),
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    map1: {
+        apply_patch: function (patch, figure) {
+            const updated = patch && applyMap1Patch(patch, figure);
+            return updated || window.dash_clientside.no_update;
+        },
+
+        // Show the latest approximate map, then its exact map once it is
+        // ready, ignoring exact maps of filters that have changed since
+        select_patch: function (approximate, exact, figure) {
+            const triggered = window.dash_clientside.callback_context.triggered.map(
+                (t) => t.prop_id
+            );
+            let patch = approximate;
+            if (triggered.includes("figure1-exact.data")) {
+                if (!approximate || !exact || exact.key !== approximate.key) {
+                    return window.dash_clientside.no_update;
+                }
+                patch = exact;
+            }
+            const updated = patch && applyMap1Patch(patch, figure);
+            return updated || window.dash_clientside.no_update;
+        },
+    },
+});
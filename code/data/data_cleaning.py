@@ -1,4 +1,5 @@
 import argparse
+import calendar
 import json
 import os
 import shutil
@@ -22,9 +23,16 @@ RATE_CODES = {
 }
 
 
+def taxi_months_suffix(months):
+    """Returns the suffix of the taxi data file names for a list of months,
+    e.g. "nov" for [11] or "sep_oct_nov" for [9, 10, 11]"""
+    return "_".join(calendar.month_abbr[month].lower() for month in sorted(months))
+
+
 def main(args):
     data_name = args.data
     create_sample = args.create_sample
+    months = args.months
 
     print(
         "[INFO] Preparing to clean {} data...".format(
@@ -57,7 +65,7 @@ def main(args):
             print("[INFO] Loading existing raw file: {}".format(taxi_2014_file_path))
 
         df = pd.read_csv(taxi_2014_file_path, engine="pyarrow")
-        process_taxi_2014_data(df, create_sample)
+        process_taxi_2014_data(df, create_sample, months)
 
         if not os.path.exists(taxi_2021_file_path):
             print("[INFO] Downloading raw file to: {}".format(taxi_2021_file_path))
@@ -71,7 +79,7 @@ def main(args):
             print("[INFO] Loading existing raw file: {}".format(taxi_2021_file_path))
 
         df = pd.read_csv(taxi_2021_file_path, engine="pyarrow")
-        process_taxi_2021_data(df, create_sample)
+        process_taxi_2021_data(df, create_sample, months)
 
     # Popular Times Data
     if data_name in ["popular_times", "all"]:
@@ -119,66 +127,44 @@ def main(args):
         process_land_use_data(land_use_df, create_sample)
 
 
-def _batch_coordinate_in_manhattan_pickup(df):
-    from utils import batch_coordinate_in_manhattan
-
-    return batch_coordinate_in_manhattan(df)
-
-
-def _batch_coordinate_in_manhattan_dropoff(df):
-    from utils import batch_coordinate_in_manhattan
-
-    return batch_coordinate_in_manhattan(
-        df, longitude_header="dropoff_longitude", latitude_header="dropoff_latitude"
-    )
-
-
-def _batch_coordinate_to_zone_pickup(df):
-    from utils import batch_coordinate_to_zone
+def _batch_coordinate_to_labels_pickup(df):
+    from utils import batch_coordinate_to_labels
 
-    return batch_coordinate_to_zone(df)
+    return batch_coordinate_to_labels(df, boroughs=["Manhattan"])
 
 
-def _batch_coordinate_to_zone_dropoff(df):
-    from utils import batch_coordinate_to_zone
+def _batch_coordinate_to_labels_dropoff(df):
+    from utils import batch_coordinate_to_labels
 
-    return batch_coordinate_to_zone(
-        df, longitude_header="dropoff_longitude", latitude_header="dropoff_latitude"
+    return batch_coordinate_to_labels(
+        df,
+        longitude_header="dropoff_longitude",
+        latitude_header="dropoff_latitude",
+        boroughs=["Manhattan"],
     )
 
 
-def _batch_coordinate_to_census_tract_pickup(df):
-    from utils import batch_coordinate_to_census_tract
-
-    return batch_coordinate_to_census_tract(df)
-
-
-def _batch_coordinate_to_census_tract_dropoff(df):
-    from utils import batch_coordinate_to_census_tract
-
-    return batch_coordinate_to_census_tract(
-        df, longitude_header="dropoff_longitude", latitude_header="dropoff_latitude"
+def process_taxi_2014_data(df, create_sample=False, months=(11,)):
+    clean_data_filename = "manhattan_taxi_2014_{}.csv".format(
+        taxi_months_suffix(months)
     )
-
-
-def process_taxi_2014_data(df, create_sample=False):
-    clean_data_filename = "manhattan_taxi_2014_nov.csv"
     clean_data_path = os.path.join(CLEAN_DATA_ROOT, clean_data_filename)
 
     if not os.path.exists(clean_data_path):
         print("[INFO] Cleaning 2014 Taxi Trip data...")
-        from utils import parallel_proc
+        from utils import parallel_proc, preload_geocoding
 
-        sample_size = 800000
+        # Number of trips kept per month
+        sample_size = 800000 * len(months)
 
         print("[INFO] Updating column headers.")
         # Unify column headers
         df = df.rename(columns={"vendor_id": "vendor"})
 
         print("[INFO] Dropping invalid rows.")
-        # Select only data from November 2014
-        df = df[df["pickup_datetime"].dt.month == 11]
-        df = df[df["dropoff_datetime"].dt.month == 11]
+        # Select only data from the selected months of 2014
+        df = df[df["pickup_datetime"].dt.month.isin(months)]
+        df = df[df["dropoff_datetime"].dt.month.isin(months)]
 
         # Drop rows with NaN
         df = df.dropna()
@@ -201,8 +187,25 @@ def process_taxi_2014_data(df, create_sample=False):
         # Drop data outside of Manhattan
         if len(df) > sample_size * 3:
             df = df.sample(sample_size * 3)
-        df = df[parallel_proc(df, _batch_coordinate_in_manhattan_pickup, n_cores=16)]
-        df = df[parallel_proc(df, _batch_coordinate_in_manhattan_dropoff, n_cores=16)]
+        # Borough, taxi zone and census tract of both ends in a single pass
+        pickup_labels = parallel_proc(
+            df,
+            _batch_coordinate_to_labels_pickup,
+            n_cores=16,
+            preload=preload_geocoding,
+        )
+        dropoff_labels = parallel_proc(
+            df,
+            _batch_coordinate_to_labels_dropoff,
+            n_cores=16,
+            preload=preload_geocoding,
+        )
+        in_manhattan = (pickup_labels["borough"] == "Manhattan") & (
+            dropoff_labels["borough"] == "Manhattan"
+        )
+        df = df[in_manhattan]
+        pickup_labels = pickup_labels[in_manhattan]
+        dropoff_labels = dropoff_labels[in_manhattan]
 
         # Update cell values
         df["vendor"] = df["vendor"].apply(
@@ -221,21 +224,13 @@ def process_taxi_2014_data(df, create_sample=False):
 
         print("[INFO] Inserting census tract indices.")
         # Add census tract index to each entry
-        df["pickup_census_tract_idx"] = parallel_proc(
-            df, _batch_coordinate_to_census_tract_pickup, n_cores=16
-        )
-        df["dropoff_census_tract_idx"] = parallel_proc(
-            df, _batch_coordinate_to_census_tract_dropoff, n_cores=16
-        )
+        df["pickup_census_tract_idx"] = pickup_labels["census_tract"]
+        df["dropoff_census_tract_idx"] = dropoff_labels["census_tract"]
 
         print("[INFO] Inserting taxi zone ids.")
         # Add taxi zone to each entry
-        df["pickup_zone"] = parallel_proc(
-            df, _batch_coordinate_to_zone_pickup, n_cores=16
-        )
-        df["dropoff_zone"] = parallel_proc(
-            df, _batch_coordinate_to_zone_dropoff, n_cores=16
-        )
+        df["pickup_zone"] = pickup_labels["zone"]
+        df["dropoff_zone"] = dropoff_labels["zone"]
 
         # Sample data
         if len(df) > sample_size:
@@ -246,7 +241,9 @@ def process_taxi_2014_data(df, create_sample=False):
         df.to_csv(clean_data_path, index=False)
 
         if create_sample:
-            sample_data_filename = "sample_manhattan_taxi_2014_nov.csv"
+            sample_data_filename = "sample_manhattan_taxi_2014_{}.csv".format(
+                taxi_months_suffix(months)
+            )
             sample_data_path = os.path.join(SAMPLE_DATA_ROOT, sample_data_filename)
 
             if not os.path.exists(sample_data_path):
@@ -262,15 +259,18 @@ def process_taxi_2014_data(df, create_sample=False):
         print("[INFO] Found existing clean file: {}".format(clean_data_path))
 
 
-def process_taxi_2021_data(df, create_sample=False):
-    clean_data_filename = "manhattan_taxi_2021_nov.csv"
+def process_taxi_2021_data(df, create_sample=False, months=(11,)):
+    clean_data_filename = "manhattan_taxi_2021_{}.csv".format(
+        taxi_months_suffix(months)
+    )
     clean_data_path = os.path.join(CLEAN_DATA_ROOT, clean_data_filename)
 
     if not os.path.exists(clean_data_path):
         print("[INFO] Cleaning 2021 Taxi Trip data...")
         from utils import borough_zone_ids
 
-        sample_size = 1000000
+        # Number of trips kept per month
+        sample_size = 1000000 * len(months)
 
         print("[INFO] Updating column headers.")
         # Unify column headers
@@ -286,9 +286,9 @@ def process_taxi_2021_data(df, create_sample=False):
         )
 
         print("[INFO] Dropping invalid rows.")
-        # Select only data from November 2021
-        df = df[df["pickup_datetime"].dt.month == 11]
-        df = df[df["dropoff_datetime"].dt.month == 11]
+        # Select only data from the selected months of 2021
+        df = df[df["pickup_datetime"].dt.month.isin(months)]
+        df = df[df["dropoff_datetime"].dt.month.isin(months)]
 
         # Drop rows with NaN
         df = df.dropna()
@@ -337,7 +337,9 @@ def process_taxi_2021_data(df, create_sample=False):
         df.to_csv(clean_data_path, index=False)
 
         if create_sample:
-            sample_data_filename = "sample_manhattan_taxi_2021_nov.csv"
+            sample_data_filename = "sample_manhattan_taxi_2021_{}.csv".format(
+                taxi_months_suffix(months)
+            )
             sample_data_path = os.path.join(SAMPLE_DATA_ROOT, sample_data_filename)
 
             if not os.path.exists(sample_data_path):
@@ -483,6 +485,16 @@ if __name__ == "__main__":
 
     parser.add_argument("--create_sample", default=False, action="store_true")
 
+    parser.add_argument(
+        "--months",
+        default=[11],
+        type=int,
+        nargs="+",
+        help="Months of the taxi data to keep.",
+        choices=range(1, 13),
+        metavar="MONTH",
+    )
+
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,386 @@
+import argparse
+import itertools
+import time
+from collections import Counter
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+
+from utils.compact import CATEGORICAL_HEADERS, FLOAT32_HEADERS, INT_HEADERS
+from utils.filtering import (
+    PAYMENT_TYPE_LABELS,
+    RANGE_FILTER_HEADERS,
+    PaymentType,
+    TaxiCoordType,
+    Weekday,
+    _check_ranges,
+    taxi_coord_headers,
+)
+
+# Format of the timestamps in the taxi CSV files, e.g. "11/28/2021 01:02:49 PM"
+TAXI_DATETIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+# Number of rows read from disk at a time when scanning a taxi dataset
+SCAN_BATCH_SIZE = 64 * 1024
+
+# Number of record batches a scan reads ahead of the one being aggregated
+SCAN_BATCH_READAHEAD = 4
+
+# Number of rows per Parquet row group, the unit skipped by predicate pushdown
+ROW_GROUP_SIZE = 128 * 1024
+
+# Hive partitioning of the taxi datasets, e.g. pickup_year=2021/pickup_month=11/
+# pickup_weekday=0/, so that queries only open the files of the selected period
+# and weekdays
+TAXI_PARTITIONING = ds.partitioning(
+    pa.schema(
+        [
+            ("pickup_year", pa.int16()),
+            ("pickup_month", pa.int8()),
+            ("pickup_weekday", pa.int8()),
+        ]
+    ),
+    flavor="hive",
+)
+
+
+def _taxi_column_types():
+    """Returns the Arrow types of the taxi columns, with the compact dtypes of
+    `compact_taxi_df` so that filters compare values like the in-memory app"""
+    column_types = {header: pa.float32() for header in FLOAT32_HEADERS}
+    column_types.update(
+        {header: pa.from_numpy_dtype(dtype) for header, dtype in INT_HEADERS.items()}
+    )
+    column_types.update({header: pa.string() for header in CATEGORICAL_HEADERS})
+    return column_types
+
+
+def _with_derived_columns(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Adds the weekday (Monday is 0) and hour columns of the pickup and dropoff
+    timestamps, and the pickup year and month, to a batch of taxi trips"""
+    columns = dict(zip(batch.schema.names, batch.columns))
+    for taxi_coord_type in TaxiCoordType:
+        headers = taxi_coord_headers(taxi_coord_type)
+        datetime = columns[headers["weekday"].replace("weekday", "datetime")]
+        columns[headers["weekday"]] = pc.day_of_week(datetime).cast(pa.int8())
+        columns[headers["hour"]] = pc.hour(datetime).cast(pa.int8())
+    columns["pickup_year"] = pc.year(columns["pickup_datetime"]).cast(pa.int16())
+    columns["pickup_month"] = pc.month(columns["pickup_datetime"]).cast(pa.int8())
+    for header, column in columns.items():
+        if header in CATEGORICAL_HEADERS:
+            columns[header] = column.dictionary_encode()
+    return pa.RecordBatch.from_pydict(columns)
+
+
+def _read_taxi_csv(csv_path):
+    """Yields the batches of trips of a taxi CSV file, see
+    `_with_derived_columns`"""
+    column_names = pv.open_csv(csv_path).schema.names
+    column_types = {
+        header: column_type
+        for header, column_type in _taxi_column_types().items()
+        if header in column_names
+    }
+    reader = pv.open_csv(
+        csv_path,
+        convert_options=pv.ConvertOptions(
+            column_types=column_types, timestamp_parsers=[TAXI_DATETIME_FORMAT]
+        ),
+    )
+    for batch in reader:
+        yield _with_derived_columns(batch)
+
+
+def write_taxi_dataset(csv_paths, dataset_path, row_group_size=ROW_GROUP_SIZE):
+    """Converts taxi CSV files, e.g. one per month, to a Parquet dataset
+    partitioned by pickup year, month and weekday (see `TAXI_PARTITIONING`)
+    readable by `ArrowTaxiDataset`, one block of the CSV files at a time.
+    Partitions of the dataset holding trips of `csv_paths` are replaced."""
+    batches = itertools.chain.from_iterable(
+        _read_taxi_csv(csv_path) for csv_path in csv_paths
+    )
+    first_batch = next(batches)
+
+    ds.write_dataset(
+        itertools.chain([first_batch], batches),
+        dataset_path,
+        schema=first_batch.schema,
+        format="parquet",
+        partitioning=TAXI_PARTITIONING,
+        # Buffer the rows of each partition, so that row groups are not cut
+        # at every block of the CSV files
+        min_rows_per_group=row_group_size // 8,
+        max_rows_per_group=row_group_size,
+        existing_data_behavior="delete_matching",
+    )
+
+
+def _date_range_expression(date_range) -> ds.Expression:
+    """Returns the dataset expression selecting the trips picked up from the
+    first to the last day of `date_range`, given as ["YYYY-MM-DD", ...]. The
+    predicates on the partition columns let Arrow skip the other months."""
+    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+    months = pd.period_range(start, end, freq="M")
+
+    expression = None
+    for year in sorted(set(months.year)):
+        year_months = [month for month in months if month.year == year]
+        year_expression = (ds.field("pickup_year") == year) & ds.field(
+            "pickup_month"
+        ).isin(pa.array([month.month for month in year_months], type=pa.int8()))
+        if expression is None:
+            expression = year_expression
+        else:
+            expression |= year_expression
+
+    pickup_datetime = ds.field("pickup_datetime")
+    expression &= pickup_datetime >= pa.scalar(start.to_pydatetime())
+    expression &= pickup_datetime < pa.scalar(
+        (end + pd.Timedelta(days=1)).to_pydatetime()
+    )
+    return expression
+
+
+class ArrowTaxiDataset:
+    """Taxi trips in an on-disk Parquet dataset, see `write_taxi_dataset`.
+
+    The taxi filters are turned into a dataset expression, so Arrow only opens
+    the partitions of the selected period and weekdays, skips the row groups
+    whose statistics rule them out, and only reads the columns the filters and
+    the result need. Results are aggregated one record batch at a
+    time, so memory use does not grow with the size of the dataset.
+    """
+
+    def __init__(self, path, batch_size=SCAN_BATCH_SIZE):
+        self.dataset = ds.dataset(
+            path, format="parquet", partitioning=TAXI_PARTITIONING
+        )
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return self.dataset.count_rows()
+
+    def _values(self, header, values):
+        """Returns `values` as an array of the type of column `header`"""
+        value_type = self.dataset.schema.field(header).type
+        if pa.types.is_dictionary(value_type):
+            value_type = value_type.value_type
+        return pa.array(values, type=value_type)
+
+    def _bound(self, header, value):
+        """Returns `value` as a scalar of the type of column `header`, so float32
+        columns are compared in float32 like NumPy does in memory"""
+        return pa.scalar(value).cast(self.dataset.schema.field(header).type)
+
+    def filter_expression(
+        self,
+        taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP,
+        trip_distance: List[float] = None,
+        fare_amount: List[float] = None,
+        tip_amount: List[float] = None,
+        total_amount: List[float] = None,
+        payment_type: List[PaymentType] = None,
+        weekday: List[Weekday] = None,
+        hour: List[int] = None,
+        date_range: List[str] = None,
+    ) -> ds.Expression:
+        """Returns the dataset expression of the filters of `filter_taxi_df`,
+        and of the pickup `date_range` ["YYYY-MM-DD", "YYYY-MM-DD"] if given"""
+        _check_ranges(trip_distance, fare_amount, tip_amount, total_amount)
+
+        headers = taxi_coord_headers(taxi_coord_type)
+        payment_labels = [PAYMENT_TYPE_LABELS[t] for t in payment_type]
+        weekday = [d.value - 1 for d in weekday]
+
+        expression = ds.field("payment_type").isin(
+            self._values("payment_type", payment_labels)
+        )
+        expression &= ds.field(headers["weekday"]).isin(
+            self._values(headers["weekday"], weekday)
+        )
+        expression &= ds.field(headers["hour"]).isin(
+            self._values(headers["hour"], hour)
+        )
+        for header, (low, high) in zip(
+            RANGE_FILTER_HEADERS, [trip_distance, fare_amount, tip_amount, total_amount]
+        ):
+            expression &= ds.field(header) >= self._bound(header, low)
+            expression &= ds.field(header) <= self._bound(header, high)
+
+        if date_range is not None:
+            expression &= _date_range_expression(date_range)
+
+        return expression
+
+    def n_files(self, expression=None):
+        """Returns the number of files of the dataset a scan with `expression`
+        opens, the others being pruned from their partition"""
+        return len(list(self.dataset.get_fragments(filter=expression)))
+
+    def scan(self, columns, expression=None):
+        """Yields the record batches of `columns` of the rows matching
+        `expression`"""
+        scanner = self.dataset.scanner(
+            columns=columns,
+            filter=expression,
+            batch_size=self.batch_size,
+            batch_readahead=SCAN_BATCH_READAHEAD,
+        )
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield batch
+
+    def filter_taxi_df(
+        self, taxi_coord_type: TaxiCoordType, *filters, date_range=None
+    ) -> pd.DataFrame:
+        """Same as `filter_taxi_df`, reading only the selected rows of the
+        `longitude`, `latitude` and `census_tract_idx` columns"""
+        headers = taxi_coord_headers(taxi_coord_type)
+        names = ["longitude", "latitude", "census_tract_idx"]
+        columns = [headers[name] for name in names]
+        table = pa.Table.from_batches(
+            self.scan(
+                columns,
+                self.filter_expression(
+                    taxi_coord_type, *filters, date_range=date_range
+                ),
+            ),
+            schema=pa.schema([self.dataset.schema.field(c) for c in columns]),
+        )
+        return table.rename_columns(names).to_pandas()
+
+    def tract_counts(
+        self, taxi_coord_type: TaxiCoordType, *filters, date_range=None
+    ) -> pd.Series:
+        """Returns the number of trips per census tract selected by the same
+        filters as `filter_taxi_df`, like `value_counts` on the filtered
+        census tract column, counting one record batch at a time"""
+        header = taxi_coord_headers(taxi_coord_type)["census_tract_idx"]
+        counts = Counter()
+        expression = self.filter_expression(
+            taxi_coord_type, *filters, date_range=date_range
+        )
+        for batch in self.scan([header], expression):
+            batch_counts = pc.value_counts(pc.drop_null(batch.column(0)))
+            counts.update(
+                dict(
+                    zip(
+                        batch_counts.field("values").to_pylist(),
+                        batch_counts.field("counts").to_pylist(),
+                    )
+                )
+            )
+        counts = pd.Series(counts, dtype=np.int64, name=header)
+        return counts.sort_values(ascending=False)
+
+    def _row_group_statistics(self, header):
+        """Yields the statistics {"min": ..., "max": ...} of column `header` in
+        every row group of the dataset, read from the Parquet metadata"""
+        for fragment in self.dataset.get_fragments():
+            for row_group in fragment.row_groups:
+                statistics = row_group.statistics.get(header)
+                if statistics is not None:
+                    yield statistics
+
+    def column_range(self, header):
+        """Returns the [min, max] of a numerical column, as an array of its dtype,
+        from the statistics of the row groups without reading the data"""
+        statistics = list(self._row_group_statistics(header))
+        dtype = self.dataset.schema.field(header).type.to_pandas_dtype()
+        # Adding zero turns a -0.0 minimum into 0.0
+        return (
+            np.array(
+                [
+                    min(s["min"] for s in statistics),
+                    max(s["max"] for s in statistics),
+                ],
+                dtype=dtype,
+            )
+            + 0
+        )
+
+    def date_range(self):
+        """Returns the first and last days of the pickups as ["YYYY-MM-DD", ...]"""
+        statistics = list(self._row_group_statistics("pickup_datetime"))
+        return [
+            min(s["min"] for s in statistics).strftime("%Y-%m-%d"),
+            max(s["max"] for s in statistics).strftime("%Y-%m-%d"),
+        ]
+
+    def unique_values(self, header):
+        """Returns the sorted distinct values of a column"""
+        values = set()
+        for batch in self.scan([header]):
+            values.update(pc.unique(batch.column(0)).to_pylist())
+        values.discard(None)
+        return sorted(values)
+
+
+def _report_query(dataset, name, filters, date_range=None):
+    """Prints the files opened, time and trips of a per-tract count query"""
+    expression = dataset.filter_expression(
+        TaxiCoordType.PICKUP, *filters, date_range=date_range
+    )
+    start = time.perf_counter()
+    counts = dataset.tract_counts(TaxiCoordType.PICKUP, *filters, date_range=date_range)
+    print(
+        "[INFO] {}: opened {} of {} files, counted {} trips in {} census tracts in {:.2f}s.".format(
+            name,
+            dataset.n_files(expression),
+            dataset.n_files(),
+            counts.sum(),
+            len(counts),
+            time.perf_counter() - start,
+        )
+    )
+
+
+def main(args):
+    start = time.perf_counter()
+    write_taxi_dataset(args.csv_paths, args.dataset_path)
+    print(
+        "[INFO] Wrote {} in {:.2f}s.".format(
+            args.dataset_path, time.perf_counter() - start
+        )
+    )
+
+    dataset = ArrowTaxiDataset(args.dataset_path)
+    ranges = [dataset.column_range(header) for header in RANGE_FILTER_HEADERS]
+    _report_query(
+        dataset,
+        "All trips",
+        ranges + [list(PaymentType), list(Weekday), list(range(24))],
+    )
+
+    # Mondays of the last month of the dataset
+    last_day = pd.Timestamp(dataset.date_range()[1])
+    _report_query(
+        dataset,
+        "Mondays of {}".format(last_day.strftime("%B %Y")),
+        ranges + [list(PaymentType), [Weekday.MONDAY], list(range(24))],
+        date_range=[
+            last_day.replace(day=1).strftime("%Y-%m-%d"),
+            dataset.date_range()[1],
+        ],
+    )
+    print(
+        "[INFO] Peak memory allocated by Arrow: {:.1f} MB.".format(
+            pa.default_memory_pool().max_memory() / 2**20
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Taxi Parquet Dataset")
+
+    parser.add_argument("csv_paths", nargs="+", help="Taxi CSV files to convert.")
+    parser.add_argument("dataset_path", help="Directory of the Parquet dataset.")
+
+    args = parser.parse_args()
+
+    main(args)
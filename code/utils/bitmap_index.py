@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+
+class BitmapIndex:
+    """Bitmap index of a low-cardinality column.
+
+    Every distinct value of the column gets a packed bit array (one bit per row,
+    8 rows per byte) marking the rows holding it, so selecting the rows whose
+    value is in a set is a bitwise OR of a few bitmaps.
+    """
+
+    def __init__(self, values):
+        values = pd.Series(values)
+        self.n_rows = len(values)
+        codes, uniques = pd.factorize(values, sort=True)
+        self.bitmaps = {
+            value: np.packbits(codes == i) for i, value in enumerate(uniques.tolist())
+        }
+        self.empty = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def nbytes(self):
+        """Memory used by the bitmaps in bytes"""
+        return sum(bitmap.nbytes for bitmap in self.bitmaps.values())
+
+    def select(self, values):
+        """Returns the packed bitmap of the rows whose value is in `values`"""
+        result = self.empty.copy()
+        for value in values:
+            bitmap = self.bitmaps.get(value)
+            if bitmap is not None:
+                np.bitwise_or(result, bitmap, out=result)
+        return result
+
+
+def unpack_bitmap(bitmap, n_rows):
+    """Converts a packed bitmap back to a boolean mask of length `n_rows`"""
+    return np.unpackbits(bitmap, count=n_rows).view(bool)
+
+
+def bitmap_contains(bitmap, rows):
+    """Returns whether the bits of `rows` are set in a packed bitmap"""
+    rows = np.asarray(rows, dtype=np.int64)
+    return ((bitmap[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
@@ -1,21 +1,17 @@
+import functools
 import json
 import math
 import os
-import sys
 from urllib.parse import urlparse
 
 import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-import requests
-import shapely
 
-from utils.utils import manhanttan_tract_polys
+from utils.utils import get_manhattan_tract_polys
 
 # Note: Bad Practice! Should never commit the token.
 TOKEN_PATH = "./data/.mapbox_token"
-mapbox_access_token = open(TOKEN_PATH).read()
 
 # Define sets of 9 colors to be used
 # Order: bottom-left, bottom-center, bottom-right, center-left, center-center, center-right, top-left, top-center, top-right
@@ -56,6 +52,14 @@ color_sets = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def get_mapbox_access_token():
+    """
+    Function to read the Mapbox access token on first use
+    """
+    return open(TOKEN_PATH).read()
+
+
 def conf_defaults():
     """
     Function to set default variables
@@ -127,6 +131,7 @@ def load_geojson(geojson_url, data_dir="./data/supplementary/", local_file=False
 
     # Download GeoJSON in case it doesn't exist
     if not os.path.exists(geojson_file):
+        import requests
 
         # Make http request for remote file data
         geojson_request = requests.get(geojson_url)
@@ -155,34 +160,147 @@ def set_interval_value(x, break_1, break_2):
         return 2
 
 
-def join_taxi_with_pt_df(taxi_df, popular_times_df):
+def join_taxi_with_pt_df(taxi_df, popular_times_df, tract_ids=None):
+    # Calculate the trip count for each census tract
+    return join_tract_counts_with_pt_df(
+        taxi_df["census_tract_idx"].value_counts(), popular_times_df, tract_ids
+    )
+
+
+def join_tract_counts_with_pt_df(tract_counts, popular_times_df, tract_ids=None):
+    """Same as `join_taxi_with_pt_df`, from trip counts per census tract given
+    as a Series {census_tract_idx: count}"""
     # Calculate popularity for each census tract
     by_tract_pt = popular_times_df.groupby("census_tract_idx")["pt_vec"].mean()
-    by_tract_pt_mean = by_tract_pt.apply(np.mean)
-    by_tract_pt_mean = (
-        pd.DataFrame(by_tract_pt_mean)
-        .reset_index(drop=True)
-        .rename(columns={"pt_vec": "popularity"})
+    return join_tract_counts_with_popularity(
+        tract_counts, by_tract_pt.apply(np.mean), tract_ids
     )
 
-    # Calculate the trip count for each census tract
-    by_tract_pickup_cnt = taxi_df["census_tract_idx"].value_counts()
-    by_tract_pickup_cnt = pd.DataFrame(by_tract_pickup_cnt).rename(
-        columns={"census_tract_idx": "taxi"}
-    )
+
+def join_tract_counts_with_popularity(tract_counts, tract_popularity, tract_ids=None):
+    """Same as `join_tract_counts_with_pt_df`, from the popularity of each census
+    tract given as a Series {census_tract_idx: popularity}, see
+    `PopularTimesTensor.tract_popularity`. The rows follow `tract_ids`, the
+    census tracts of the map by default (see `get_tract_ids`)."""
+    if tract_ids is None:
+        tract_ids = get_tract_ids()
+
+    by_tract_pt_mean = pd.DataFrame(tract_popularity.astype(float).rename("popularity"))
+
+    by_tract_pickup_cnt = pd.DataFrame({"taxi": tract_counts})
 
     # Join the dataframes
     joined_df = (
         pd.concat([by_tract_pt_mean, by_tract_pickup_cnt], axis=1, join="outer")
-        .reindex(manhanttan_tract_polys.keys())
+        .reindex(tract_ids)
         .fillna(0)
         .reset_index(names="id")
     )
-    joined_df
 
     return joined_df
 
 
+def get_tract_ids():
+    """Returns the indices of the census tracts of the map, in the fixed order
+    of `get_manhattan_tract_polys`"""
+    return np.fromiter(get_manhattan_tract_polys().keys(), dtype=np.int64)
+
+
+def _tract_positions(tract_ids, values):
+    """Returns the position in `tract_ids` of every census tract index in
+    `values`, or -1 for the ones not in `tract_ids`"""
+    tract_ids = np.asarray(tract_ids, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    if tract_ids.size == 0:
+        return np.full(values.shape, -1, dtype=np.int64)
+
+    order = np.argsort(tract_ids, kind="stable")
+    sorted_ids = tract_ids[order]
+    positions = np.minimum(np.searchsorted(sorted_ids, values), sorted_ids.size - 1)
+    return np.where(sorted_ids[positions] == values, order[positions], -1)
+
+
+def count_tract_trips(census_tract_idx, tract_ids):
+    """Returns the number of trips in each census tract of `tract_ids`, from
+    the census tract index of every trip"""
+    positions = _tract_positions(tract_ids, census_tract_idx)
+    return np.bincount(positions[positions >= 0], minlength=len(tract_ids)).astype(
+        float
+    )
+
+
+def align_tract_counts(tract_counts, tract_ids):
+    """Returns the trip counts of a Series {census_tract_idx: count} for each
+    census tract of `tract_ids`, 0 for the missing ones"""
+    positions = _tract_positions(tract_ids, tract_counts.index)
+    found = positions >= 0
+    counts = np.zeros(len(tract_ids))
+    counts[positions[found]] = tract_counts.to_numpy(dtype=float)[found]
+    return counts
+
+
+def align_tract_popularity(tract_popularity, tract_ids):
+    """Returns the popularity of a Series {census_tract_idx: popularity} for
+    each census tract of `tract_ids`, 0 for the missing ones"""
+    popularity = tract_popularity.reindex(tract_ids, fill_value=0).to_numpy(dtype=float)
+    popularity[np.isnan(popularity)] = 0
+    return popularity
+
+
+def bivariate_classes(x_values, y_values):
+    """Returns the position (0 to 8) of every x/y value pair in the 9-color
+    matrix of bivariate colors, with the breaks of `prepare_df`. Mirrored in
+    the browser by `bivariateClasses` of assets/map1.js."""
+    x_values = np.asarray(x_values, dtype=float)
+    y_values = np.asarray(y_values, dtype=float)
+    if x_values.shape != y_values.shape:
+        raise ValueError(
+            "ERROR: The list of x and y coordinates must have the same length."
+        )
+
+    # Bins (0, 1, 2) split at percentiles 33 and 66, upper breaks included
+    x_bins = np.digitize(x_values, np.percentile(x_values, [33, 66]), right=True)
+    y_bins = np.digitize(y_values, np.percentile(y_values, [33, 66]), right=True)
+    return (x_bins + 3 * y_bins).astype(np.int8)
+
+
+def tract_value_arrays(tract_counts, tract_popularity, tract_ids=None):
+    """Vectorized `join_tract_counts_with_popularity`.
+
+    Returns the trip counts and the popularity of the census tracts of
+    `tract_ids` as arrays in the same order. `tract_counts` is a Series
+    {census_tract_idx: count} or an array aligned with `tract_ids`, see
+    `count_tract_trips`.
+    """
+    if tract_ids is None:
+        tract_ids = get_tract_ids()
+    if isinstance(tract_counts, pd.Series):
+        tract_counts = align_tract_counts(tract_counts, tract_ids)
+    return tract_counts, align_tract_popularity(tract_popularity, tract_ids)
+
+
+def bivariate_tract_arrays(tract_counts, tract_popularity, tract_ids=None):
+    """Vectorized `join_tract_counts_with_popularity` followed by `prepare_df`.
+
+    Returns the arrays of `tract_value_arrays` and the bivariate class codes
+    (see `bivariate_classes`) of the census tracts of `tract_ids`.
+    """
+    tract_counts, popularity = tract_value_arrays(
+        tract_counts, tract_popularity, tract_ids
+    )
+    return tract_counts, popularity, bivariate_classes(tract_counts, popularity)
+
+
+def tract_arrays_to_df(tract_ids, tract_counts, popularity, classes=None):
+    """Returns the DataFrame of `join_tract_counts_with_popularity` from arrays
+    aligned with `tract_ids`, with the `biv_bins` column of `prepare_df` if the
+    bivariate class codes are given"""
+    df = pd.DataFrame({"id": tract_ids, "popularity": popularity, "taxi": tract_counts})
+    if classes is not None:
+        df["biv_bins"] = classes.astype(str)
+    return df
+
+
 def prepare_df(df, x="taxi", y="popularity"):
     """
     Function that adds a column 'biv_bins' to the dataframe containing the
@@ -308,70 +426,61 @@ def create_legend(fig, colors, conf=conf_defaults()):
     return fig
 
 
-def create_bivariate_map(
-    df,
-    colors,
-    geojson,
-    x="taxi",
-    y="popularity",
-    ids="id",
-    name="name",
-    conf=conf_defaults(),
-):
+def bivariate_colorscale(colors):
+    """Returns a stepped colorscale giving `colors[i]` to the z value `i`, for
+    z values from -0.5 to `len(colors) - 0.5`"""
+    colorscale = []
+    for i, color in enumerate(colors):
+        colorscale.append([i / len(colors), color])
+        colorscale.append([(i + 1) / len(colors), color])
+    return colorscale
+
+
+def create_bivariate_map_skeleton(colors, geojson, tract_ids, conf=conf_defaults()):
+    """Returns the static part of the bivariate map of the census tracts of
+    `tract_ids`: the GeoJSON, layout and legend, and one trace whose colors
+    and hover values are set by the properties of `bivariate_map_update`"""
 
     if len(colors) != 9:
         raise ValueError(
             "ERROR: The list of bivariate colors must have a length eaqual to 9."
         )
 
-    # Prepare the dataframe with the necessary information for our bivariate map
-    df_plot = prepare_df(df, x, y)
-
-    # Create the figure
-    fig = px.choropleth_mapbox(
-        df_plot,
-        geojson=geojson,
-        locations=ids,
-        color=df_plot["biv_bins"],
-        color_discrete_map={
-            "0": colors[0],
-            "1": colors[1],
-            "2": colors[2],
-            "3": colors[3],
-            "4": colors[4],
-            "5": colors[5],
-            "6": colors[6],
-            "7": colors[7],
-            "8": colors[8],
-        },
-        custom_data=df_plot[[ids, x, y]],  # Add data to be used in hovertemplate
+    # Create the figure, colored by the bivariate class code of every tract
+    fig = go.Figure(
+        go.Choroplethmapbox(
+            geojson=geojson,
+            locations=tract_ids,
+            z=np.zeros(len(tract_ids), dtype=np.int8),
+            zmin=-0.5,
+            zmax=len(colors) - 0.5,
+            colorscale=bivariate_colorscale(colors),
+            showscale=False,  # Hide the colorscale
+            hovertemplate="<br>".join(
+                [  # Data to be displayed on hover
+                    "<b>ID: %{customdata[0]}</b>",
+                    conf["hover_x_label"] + ": %{customdata[1]:.3f}",
+                    conf["hover_y_label"] + ": %{customdata[2]:.3f}",
+                    "<extra></extra>",  # Remove secondary information
+                ]
+            ),
+            marker_line_width=conf[
+                "borders_width"
+            ],  # Width of the geographic entity borders
+            marker_line_color=conf[
+                "borders_color"
+            ],  # Color of the geographic entity borders
+        )
     )
     fig.update_layout(
         margin={"r": 0, "t": 0, "l": 0, "b": 0},
         mapbox_style="light",
-        mapbox_accesstoken=mapbox_access_token,
+        mapbox_accesstoken=get_mapbox_access_token(),
         mapbox_zoom=11,
         mapbox_center={"lat": 40.7858, "lon": -73.9800},
         showlegend=False,
         autosize=False,
-    )
-
-    fig.update_traces(
-        hovertemplate="<br>".join(
-            [  # Data to be displayed on hover
-                "<b>ID: %{customdata[0]}</b>",
-                conf["hover_x_label"] + ": %{customdata[1]:.3f}",
-                conf["hover_y_label"] + ": %{customdata[2]:.3f}",
-                "<extra></extra>",  # Remove secondary information
-            ]
-        ),
-        marker_line_width=conf[
-            "borders_width"
-        ],  # Width of the geographic entity borders
-        marker_line_color=conf[
-            "borders_color"
-        ],  # Color of the geographic entity borders
-        showscale=False,  # Hide the colorscale
+        uirevision="bivariate-map",  # Keep the user's zoom and center on updates
     )
 
     # Add the legend
@@ -380,6 +489,112 @@ def create_bivariate_map(
     # Show the correct geo location
     fig.update_geos(fitbounds="locations", visible=False)
 
+    return fig
+
+
+def bivariate_map_update(tract_ids, tract_counts, popularity, classes):
+    """Returns the properties of the trace of `create_bivariate_map_skeleton`
+    that depend on the data, from arrays aligned with `tract_ids`: the
+    bivariate class codes coloring the tracts and the values shown on hover"""
+    return {
+        "z": np.asarray(classes, dtype=np.int8).tolist(),
+        "customdata": np.column_stack([tract_ids, tract_counts, popularity]).tolist(),
+    }
+
+
+def create_bivariate_map(
+    df,
+    colors,
+    geojson,
+    x="taxi",
+    y="popularity",
+    ids="id",
+    name="name",
+    conf=conf_defaults(),
+):
+
+    # Classify the tracts for our bivariate map, without modifying `df`
+    if "biv_bins" in df:
+        classes = df["biv_bins"].astype(int)
+    else:
+        classes = bivariate_classes(df[x], df[y])
+
+    # Create the figure
+    fig = create_bivariate_map_skeleton(colors, geojson, df[ids], conf)
+    fig.update_traces(bivariate_map_update(df[ids], df[x], df[y], classes))
+
     print("[DEBUG] Updated choropleth.")
 
     return fig
+
+
+def main():
+    """Benchmarks `join_taxi_with_pt_df` followed by `prepare_df` against the
+    vectorized `count_tract_trips` and `bivariate_tract_arrays` on synthetic
+    data"""
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracts", type=int, default=2000)
+    parser.add_argument("--places", type=int, default=20000)
+    parser.add_argument("--trips", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tract_ids = rng.permutation(args.tracts).astype(np.int64)
+    place_tracts = np.concatenate(
+        [tract_ids, rng.integers(0, args.tracts, args.places - args.tracts)]
+    )
+    pt_vecs = rng.integers(0, 100, (args.places, 7, 24))
+    popular_times_df = pd.DataFrame(
+        {"census_tract_idx": place_tracts, "pt_vec": list(pt_vecs)}
+    )
+    taxi_df = pd.DataFrame(
+        {"census_tract_idx": rng.integers(0, args.tracts, args.trips)}
+    )
+
+    def current():
+        return prepare_df(join_taxi_with_pt_df(taxi_df, popular_times_df, tract_ids))
+
+    def vectorized():
+        place_tract_ids, place_tract_codes = np.unique(
+            place_tracts, return_inverse=True
+        )
+        tract_popularity = pd.Series(
+            np.bincount(place_tract_codes, weights=pt_vecs.mean(axis=(1, 2)))
+            / np.bincount(place_tract_codes),
+            index=place_tract_ids,
+        )
+        tract_counts = count_tract_trips(taxi_df["census_tract_idx"], tract_ids)
+        return tract_arrays_to_df(
+            tract_ids,
+            *bivariate_tract_arrays(tract_counts, tract_popularity, tract_ids),
+        )
+
+    results = dict()
+    for name, function in [("current", current), ("vectorized", vectorized)]:
+        elapsed = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = function()
+            elapsed.append(time.perf_counter() - start)
+        print("{:<12s} {:>10.2f} ms".format(name, 1000 * min(elapsed)))
+
+    expected, actual = results["current"], results["vectorized"]
+    same = (
+        np.array_equal(expected["id"], actual["id"])
+        and np.allclose(expected["popularity"], actual["popularity"])
+        and np.array_equal(expected["taxi"], actual["taxi"])
+        and np.array_equal(expected["biv_bins"], actual["biv_bins"])
+    )
+    print(
+        "{} tracts, {} places, {} trips: {}".format(
+            args.tracts, args.places, args.trips, "same" if same else "DIFFERENT"
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
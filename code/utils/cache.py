@@ -0,0 +1,139 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def _file_version(path):
+    """Returns the size and modification time of a file, or None if it does
+    not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (path, None)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def dataset_version(*paths):
+    """Returns a token that changes whenever one of the files at `paths` is
+    modified, from their sizes and modification times. For a directory, e.g.
+    a partitioned Parquet dataset, every file under it counts, so adding or
+    removing a file changes the token too."""
+    version = []
+    for path in paths:
+        if not os.path.isdir(path):
+            version.append(_file_version(path))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                version.append(_file_version(os.path.join(root, name)))
+    return tuple(version)
+
+
+def estimate_nbytes(value):
+    """Returns an estimate of the memory used by a cached value in bytes"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(item) for item in value.values())
+    if hasattr(value, "to_json"):
+        # Plotly figures, charged the size of their serialized JSON
+        return len(value.to_json())
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    return 0
+
+
+class ByteLRUCache:
+    """Least recently used cache bounded by the total size of its values.
+
+    Values are charged their size in bytes (see `estimate_nbytes`), and the
+    least recently used entries are evicted once the total exceeds
+    `max_bytes`. Entries belong to a dataset version: calling `invalidate`
+    with a different version drops all of them. The cache can be shared by
+    the threads of the server.
+    """
+
+    def __init__(self, max_bytes, version=None):
+        self.max_bytes = max_bytes
+        self.version = version
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, default=None):
+        """Returns the value cached for `key` and marks it as recently used"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, nbytes=None):
+        """Caches `value` for `key`, evicting the least recently used entries
+        to stay within `max_bytes`. Values larger than `max_bytes` are not
+        cached."""
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                self.evictions += 1
+
+    def invalidate(self, version):
+        """Drops all entries if `version` differs from the current one"""
+        with self.lock:
+            if version != self.version:
+                self._clear()
+                self.version = version
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Returns the counters of the cache"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# Columns of the taxi data stored as dictionary-encoded categoricals
+CATEGORICAL_HEADERS = ["vendor", "payment_type", "rate_code", "store_and_fwd_flag"]
+
+# Columns of the taxi data stored as float32 (distances, amounts and coordinates)
+FLOAT32_HEADERS = [
+    "passenger_count",
+    "trip_distance",
+    "fare_amount",
+    "extra",
+    "mta_tax",
+    "tip_amount",
+    "tolls_amount",
+    "improvement_surcharge",
+    "total_amount",
+    "congestion_surcharge",
+    "surcharge",
+    "pickup_longitude",
+    "pickup_latitude",
+    "dropoff_longitude",
+    "dropoff_latitude",
+]
+
+# Integer columns of the taxi data and their narrow dtypes
+INT_HEADERS = {
+    "pickup_weekday": np.int8,
+    "dropoff_weekday": np.int8,
+    "pickup_hour": np.int8,
+    "dropoff_hour": np.int8,
+    "pickup_zone": np.int16,
+    "dropoff_zone": np.int16,
+    "pickup_census_tract_idx": np.int16,
+    "dropoff_census_tract_idx": np.int16,
+}
+
+# Timestamp columns of the taxi data, stored as int64 seconds since the epoch
+DATETIME_HEADERS = ["pickup_datetime", "dropoff_datetime"]
+
+
+def bytes_per_row(df: pd.DataFrame) -> float:
+    """Returns the memory used by `df` per row in bytes, including the contents
+    of Python objects in object columns"""
+    return df.memory_usage(index=True, deep=True).sum() / max(len(df), 1)
+
+
+def _fits(values: pd.Series, dtype) -> bool:
+    """Checks that the integer `values` can be cast to `dtype` without loss"""
+    info = np.iinfo(dtype)
+    return (
+        values.notna().all() and values.min() >= info.min and values.max() <= info.max
+    )
+
+
+def compact_taxi_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the columns of the taxi data to compact dtypes in place.
+
+    Strings become categoricals, money, distances and coordinates become
+    float32, weekdays, hours, zones and census tract indices become int8/int16
+    (columns whose values do not fit are left as they are), and timestamps
+    become int64 seconds since the epoch. Weekday and hour columns should be
+    derived from the timestamps beforehand.
+    """
+    for header in CATEGORICAL_HEADERS:
+        if header in df:
+            df[header] = df[header].astype("category")
+
+    for header in FLOAT32_HEADERS:
+        if header in df:
+            df[header] = df[header].astype(np.float32)
+
+    for header, dtype in INT_HEADERS.items():
+        if header in df and _fits(df[header], dtype):
+            df[header] = df[header].astype(dtype)
+
+    for header in DATETIME_HEADERS:
+        if header in df and pd.api.types.is_datetime64_any_dtype(df[header]):
+            df[header] = df[header].to_numpy().astype("datetime64[s]").astype(np.int64)
+
+    return df
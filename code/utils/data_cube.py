@@ -0,0 +1,201 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from utils.filtering import (
+    PAYMENT_TYPE_LABELS,
+    PaymentType,
+    TaxiCoordType,
+    Weekday,
+    taxi_coord_headers,
+)
+
+# Numerical columns of the taxi data binned in the cube, in the order of the
+# range arguments of `TripCube.tract_counts`
+CUBE_RANGE_HEADERS = ["trip_distance", "fare_amount", "tip_amount", "total_amount"]
+
+
+def slider_range(values, decimals=2):
+    """Returns the [min, max] of a range slider over `values`, rounded outwards
+    to `decimals` so that compact float32 columns do not show as long floats"""
+    scale = 10**decimals
+    return [
+        float(np.floor(np.nanmin(values) * scale) / scale),
+        float(np.ceil(np.nanmax(values) * scale) / scale),
+    ]
+
+
+def slider_edges(values, step=1):
+    """Returns the positions a range slider over `values` can take: every `step`
+    from the minimum, plus the maximum, as compared against the column dtype"""
+    low, high = slider_range(values)
+    edges = np.append(np.arange(low, high, step), high)
+    return np.unique(edges.astype(np.asarray(values).dtype).astype(float))
+
+
+class _BinnedColumn:
+    """Bins of a numerical column, and the data values bounding each bin"""
+
+    def __init__(self, values, edges):
+        # Slider ranges are compared against the values in their own dtype,
+        # like `filter_taxi_mask` does
+        self.dtype = values.dtype
+        values = values.astype(float)
+        self.edges = np.asarray(edges, dtype=float)
+        self.codes = self.bin_of(values)
+        n_bins = 2 * self.edges.shape[0] - 1
+        self.bin_min = np.full(n_bins, np.inf)
+        self.bin_max = np.full(n_bins, -np.inf)
+        by_bin = pd.Series(values).groupby(self.codes)
+        self.bin_min[by_bin.min().index] = by_bin.min().to_numpy()
+        self.bin_max[by_bin.max().index] = by_bin.max().to_numpy()
+        self.values = np.unique(values)
+
+    def bin_of(self, values):
+        """Bin `2 * i` holds the values equal to `edges[i]`, and bin `2 * i + 1`
+        the values strictly between `edges[i]` and `edges[i + 1]`, so that both
+        ends of a slider range fall on the boundary of a bin"""
+        values = np.asarray(values, dtype=float)
+        i = np.searchsorted(self.edges, values, side="left")
+        on_edge = self.edges[np.minimum(i, self.edges.shape[0] - 1)] == values
+        return np.clip(
+            np.where(on_edge, 2 * i, 2 * i - 1), 0, 2 * self.edges.shape[0] - 2
+        )
+
+    def bin_range(self, low, high):
+        """Returns the bins (first, last) holding exactly the values in
+        [low, high], or None if the range splits a bin"""
+        # Only the data values next to `low` and `high` matter: `v >= low` is
+        # the same as `v >= first_value`, and `v <= high` as `v <= last_value`
+        low, high = np.array([low, high]).astype(self.dtype).astype(float)
+        first = np.searchsorted(self.values, low, side="left")
+        last = np.searchsorted(self.values, high, side="right") - 1
+        if first > last:
+            return 0, -1
+
+        first_bin, last_bin = self.bin_of([self.values[first], self.values[last]])
+        if (
+            self.values[first] != self.bin_min[first_bin]
+            or self.values[last] != self.bin_max[last_bin]
+        ):
+            return None
+        return first_bin, last_bin
+
+
+class TripCube:
+    """Pre-aggregated trip counts of the taxi data.
+
+    For each coordinate type, trips are counted per cell of census tract x
+    weekday x hour x payment type x binned trip distance, fare, tip and total
+    amount. Only non-empty cells are stored, as one code array per dimension
+    and a count array. The numerical columns are binned on the positions of
+    the dashboard's range sliders, so the trip counts per census tract under a
+    filter are partial sums over the cells, as long as the slider ranges do not
+    split a bin.
+    """
+
+    def __init__(self, df: pd.DataFrame, step=1):
+        numeric = [df[header].to_numpy() for header in CUBE_RANGE_HEADERS]
+        valid = ~np.any([np.isnan(values) for values in numeric], axis=0)
+
+        self.columns = [
+            _BinnedColumn(values[valid], slider_edges(values[valid], step))
+            for values in numeric
+        ]
+        payment_codes, self.payment_labels = pd.factorize(df["payment_type"][valid])
+        self.payment_labels = list(self.payment_labels)
+
+        self.cells = dict()
+        for taxi_coord_type in TaxiCoordType:
+            headers = taxi_coord_headers(taxi_coord_type)
+            tract_codes, tract_ids = pd.factorize(
+                df[headers["census_tract_idx"]][valid]
+            )
+            codes = [
+                tract_codes,
+                df[headers["weekday"]].to_numpy()[valid].astype(np.int64),
+                df[headers["hour"]].to_numpy()[valid].astype(np.int64),
+                payment_codes,
+            ] + [column.codes for column in self.columns]
+
+            # Trips without census tract or payment type are never selected
+            selected = (tract_codes >= 0) & (payment_codes >= 0)
+            codes = [code[selected] for code in codes]
+
+            # Count the trips per cell on a single flat key. Outliers can make
+            # the product of the dimension sizes overflow, so the key is ranked
+            # over the non-empty cells whenever the next dimension would not fit
+            keys = np.zeros(codes[0].shape[0], dtype=np.int64)
+            n_keys = 1
+            for code in codes:
+                size = int(code.max()) + 1 if code.shape[0] else 1
+                if n_keys * size > np.iinfo(np.int64).max:
+                    key_values, keys = np.unique(keys, return_inverse=True)
+                    n_keys = key_values.shape[0]
+                keys = keys * size + code
+                n_keys *= size
+            _, cell_rows, counts = np.unique(
+                keys, return_index=True, return_counts=True
+            )
+            self.cells[taxi_coord_type] = (
+                np.asarray(tract_ids),
+                [code[cell_rows] for code in codes],
+                counts,
+            )
+
+    @property
+    def n_cells(self):
+        """Number of non-empty cells, summed over the coordinate types"""
+        return sum(counts.shape[0] for _, _, counts in self.cells.values())
+
+    def tract_counts(
+        self,
+        taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP,
+        trip_distance: List[float] = None,
+        fare_amount: List[float] = None,
+        tip_amount: List[float] = None,
+        total_amount: List[float] = None,
+        payment_type: List[PaymentType] = None,
+        weekday: List[Weekday] = None,
+        hour: List[int] = None,
+    ):
+        """Returns the number of trips per census tract selected by the same
+        filters as `filter_taxi_df`, as a Series {census_tract_idx: count} of
+        the tracts with trips, or None if a range splits a bin of the cube and
+        the trips must be scanned instead"""
+        bin_ranges = [
+            column.bin_range(*value_range)
+            for column, value_range in zip(
+                self.columns, [trip_distance, fare_amount, tip_amount, total_amount]
+            )
+        ]
+        if any(bin_range is None for bin_range in bin_ranges):
+            return None
+
+        tract_ids, cells, counts = self.cells[taxi_coord_type]
+        tract_codes, weekday_codes, hour_codes, payment_codes = cells[:4]
+
+        payment_labels = [PAYMENT_TYPE_LABELS[t] for t in payment_type]
+        accepted_payments = np.array(
+            [label in payment_labels for label in self.payment_labels] + [False]
+        )
+        accepted_weekdays = np.zeros(8, dtype=bool)
+        accepted_weekdays[[d.value - 1 for d in weekday]] = True
+        accepted_hours = np.zeros(25, dtype=bool)
+        accepted_hours[[h for h in hour if 0 <= h < 24]] = True
+
+        mask = accepted_payments[payment_codes]
+        mask &= accepted_weekdays[weekday_codes]
+        mask &= accepted_hours[hour_codes]
+        for (first_bin, last_bin), bin_codes in zip(bin_ranges, cells[4:]):
+            mask &= bin_codes >= first_bin
+            mask &= bin_codes <= last_bin
+
+        tract_counts = np.bincount(
+            tract_codes[mask], weights=counts[mask], minlength=tract_ids.shape[0]
+        ).astype(np.int64)
+        nonzero = np.flatnonzero(tract_counts)
+        return pd.Series(
+            tract_counts[nonzero], index=tract_ids[nonzero], name="census_tract_idx"
+        )
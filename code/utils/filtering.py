@@ -1,9 +1,12 @@
 from enum import Enum
-from typing import List
+from typing import Dict, List
 
 import numpy as np
 import pandas as pd
 
+from utils.bitmap_index import BitmapIndex, bitmap_contains, unpack_bitmap
+from utils.range_index import SortedRangeIndex
+
 
 class TaxiCoordType(str, Enum):
     PICKUP = 1
@@ -29,17 +32,48 @@ class Weekday(Enum):
     SUNDAY = 7
 
 
-def filter_taxi_df(
-    df: pd.DataFrame,
-    taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP,
-    trip_distance: List[float] = None,
-    fare_amount: List[float] = None,
-    tip_amount: List[float] = None,
-    total_amount: List[float] = None,
-    payment_type: List[PaymentType] = None,
-    weekday: List[Weekday] = None,
-    hour: List[int] = None,
-) -> pd.DataFrame:
+# Values of the `payment_type` column of the taxi data for each payment type
+PAYMENT_TYPE_LABELS = {
+    PaymentType.CREDITCARD: "Credit card",
+    PaymentType.CASH: "Cash",
+    PaymentType.NOCHARGE: "No charge",
+    PaymentType.DISPUTE: "Dispute",
+    PaymentType.UNKNOWN: "Unknown",
+    PaymentType.VOIDEDTRIP: "Voided trip",
+}
+
+
+# Numerical columns of the taxi data filtered on with a range, in the order of
+# the range arguments of `filter_taxi_df`
+RANGE_FILTER_HEADERS = ["trip_distance", "fare_amount", "tip_amount", "total_amount"]
+
+# Largest share of the rows the most selective range may select for
+# `filter_taxi_indices` to start from it instead of evaluating a full mask
+RANGE_INDEX_MAX_SELECTIVITY = 0.2
+
+
+def taxi_coord_headers(taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP):
+    """Returns the column headers of the taxi data for a coordinate type as
+    {generic_name: header}, e.g. {"longitude": "pickup_longitude", ...}"""
+    prefix = "pickup" if taxi_coord_type == TaxiCoordType.PICKUP else "dropoff"
+    return {
+        "longitude": prefix + "_longitude",
+        "latitude": prefix + "_latitude",
+        "census_tract_idx": prefix + "_census_tract_idx",
+        "weekday": prefix + "_weekday",
+        "hour": prefix + "_hour",
+    }
+
+
+def _isin_small_ints(values: np.ndarray, accepted: List[int], size: int) -> np.ndarray:
+    """Same as `np.isin` for integers in [0, size), using a lookup table"""
+    table = np.zeros(size + 1, dtype=bool)
+    table[[v for v in accepted if 0 <= v < size]] = True
+    return table[np.where((values >= 0) & (values < size), values, size)]
+
+
+def _check_ranges(trip_distance, fare_amount, tip_amount, total_amount):
+    """Checks that the range arguments of the taxi filters are [low, high]"""
     assert (
         len(trip_distance) == 2
     ), "[ERROR] `trip_distance` must be of length 2, but get: {}".format(trip_distance)
@@ -53,48 +87,324 @@ def filter_taxi_df(
         len(total_amount) == 2
     ), "[ERROR] `total_amount` must be of length 2, but get: {}".format(total_amount)
 
-    payment_type = [t.name.capitalize() for t in payment_type]
+
+def build_taxi_bitmap_index(df: pd.DataFrame) -> Dict[str, BitmapIndex]:
+    """Builds bitmap indices of the categorical columns filtered on by
+    `filter_taxi_mask`, for both the pickup and the dropoff variants"""
+    headers = ["payment_type"]
+    for taxi_coord_type in TaxiCoordType:
+        coord_headers = taxi_coord_headers(taxi_coord_type)
+        headers += [coord_headers["weekday"], coord_headers["hour"]]
+    return {header: BitmapIndex(df[header]) for header in headers}
+
+
+def build_taxi_range_index(df: pd.DataFrame) -> Dict[str, SortedRangeIndex]:
+    """Builds sorted range indices of the numerical columns filtered on by
+    `filter_taxi_mask`"""
+    return {header: SortedRangeIndex(df[header]) for header in RANGE_FILTER_HEADERS}
+
+
+def filter_taxi_mask(
+    df: pd.DataFrame,
+    taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP,
+    trip_distance: List[float] = None,
+    fare_amount: List[float] = None,
+    tip_amount: List[float] = None,
+    total_amount: List[float] = None,
+    payment_type: List[PaymentType] = None,
+    weekday: List[Weekday] = None,
+    hour: List[int] = None,
+    bitmap_index: Dict[str, BitmapIndex] = None,
+) -> np.ndarray:
+    """Evaluates all the predicates of `filter_taxi_df` into a single boolean
+    mask over the rows of `df`, reading the original columns without copying
+    or renaming the DataFrame. If the `bitmap_index` of `df` is given (see
+    `build_taxi_bitmap_index`), the categorical predicates are evaluated with
+    bitwise operations on its bitmaps."""
+    _check_ranges(trip_distance, fare_amount, tip_amount, total_amount)
+
+    headers = taxi_coord_headers(taxi_coord_type)
+    payment_labels = [PAYMENT_TYPE_LABELS[t] for t in payment_type]
     weekday = [d.value - 1 for d in weekday]
-    # Make a copy in case of overwriting the original DataFrame
-    df = df.copy()
 
-    # Update columns names for the coordinates based on taxi_coord_type
-    if taxi_coord_type == TaxiCoordType.PICKUP:
-        long_header = "pickup_longitude"
-        lat_header = "pickup_latitude"
-        census_idx_header = "pickup_census_tract_idx"
-        weekday_header = "pickup_weekday"
-        hour_header = "pickup_hour"
+    # Filter based on categorical attributes
+    if bitmap_index is not None:
+        bitmap = bitmap_index["payment_type"].select(payment_labels)
+        bitmap &= bitmap_index[headers["weekday"]].select(weekday)
+        bitmap &= bitmap_index[headers["hour"]].select(hour)
+        mask = unpack_bitmap(bitmap, len(df))
     else:
-        long_header = "dropoff_longitude"
-        lat_header = "dropoff_latitude"
-        census_idx_header = "dropoff_census_tract_idx"
-        weekday_header = "dropoff_weekday"
-        hour_header = "dropoff_hour"
-    df = df.rename(
-        columns={
-            long_header: "longitude",
-            lat_header: "latitude",
-            census_idx_header: "census_tract_idx",
-        }
+        mask = df["payment_type"].isin(payment_labels).to_numpy()
+        mask &= _isin_small_ints(df[headers["weekday"]].to_numpy(), weekday, 7)
+        mask &= _isin_small_ints(df[headers["hour"]].to_numpy(), hour, 24)
+
+    # Filter based on numerical attributes, updating the mask in place
+    for header, (low, high) in zip(
+        RANGE_FILTER_HEADERS, [trip_distance, fare_amount, tip_amount, total_amount]
+    ):
+        values = df[header].to_numpy()
+        mask &= values >= low
+        mask &= values <= high
+
+    return mask
+
+
+def _range_plan(
+    range_index: Dict[str, SortedRangeIndex],
+    ranges: Dict[str, List[float]],
+    n_rows: int,
+) -> List[str]:
+    """Returns the range filter headers from the most to the least selective,
+    or None if even the most selective range keeps too many rows to start from
+    it (see `RANGE_INDEX_MAX_SELECTIVITY`)"""
+    counts = {
+        header: range_index[header].count(*ranges[header])
+        for header in RANGE_FILTER_HEADERS
+    }
+    plan = sorted(RANGE_FILTER_HEADERS, key=counts.get)
+    if counts[plan[0]] > RANGE_INDEX_MAX_SELECTIVITY * n_rows:
+        return None
+    return plan
+
+
+def filter_taxi_indices(
+    df: pd.DataFrame,
+    taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP,
+    trip_distance: List[float] = None,
+    fare_amount: List[float] = None,
+    tip_amount: List[float] = None,
+    total_amount: List[float] = None,
+    payment_type: List[PaymentType] = None,
+    weekday: List[Weekday] = None,
+    hour: List[int] = None,
+    bitmap_index: Dict[str, BitmapIndex] = None,
+    range_index: Dict[str, SortedRangeIndex] = None,
+) -> np.ndarray:
+    """Returns the positions of the rows of `df` selected by `filter_taxi_df`.
+
+    If the `range_index` of `df` is given (see `build_taxi_range_index`) and
+    one of the ranges is selective enough, the rows in that range are found by
+    binary search, and the other predicates are only checked on those rows,
+    from the most to the least selective range.
+    """
+    filters = (
+        taxi_coord_type,
+        trip_distance,
+        fare_amount,
+        tip_amount,
+        total_amount,
+        payment_type,
+        weekday,
+        hour,
+        bitmap_index,
     )
+    if range_index is None:
+        return np.flatnonzero(filter_taxi_mask(df, *filters))
 
-    # Filter based on numerical attributes
-    df = df[df["trip_distance"] >= trip_distance[0]]
-    df = df[df["trip_distance"] <= trip_distance[1]]
-    df = df[df["fare_amount"] >= fare_amount[0]]
-    df = df[df["fare_amount"] <= fare_amount[1]]
-    df = df[df["tip_amount"] >= tip_amount[0]]
-    df = df[df["tip_amount"] <= tip_amount[1]]
-    df = df[df["total_amount"] >= total_amount[0]]
-    df = df[df["total_amount"] <= total_amount[1]]
+    _check_ranges(trip_distance, fare_amount, tip_amount, total_amount)
+    ranges = dict(
+        zip(
+            RANGE_FILTER_HEADERS,
+            [trip_distance, fare_amount, tip_amount, total_amount],
+        )
+    )
+    plan = _range_plan(range_index, ranges, len(df))
+    if plan is None:
+        return np.flatnonzero(filter_taxi_mask(df, *filters))
 
-    # Filter based on categorical attributes
-    df = df[df["payment_type"].str.replace(" ", "").isin(payment_type)]
-    df = df[df[weekday_header].isin(weekday)]
-    df = df[df[hour_header].isin(hour)]
+    rows = range_index[plan[0]].rows(*ranges[plan[0]])
+    for header in plan[1:]:
+        low, high = ranges[header]
+        values = df[header].to_numpy()[rows]
+        rows = rows[(values >= low) & (values <= high)]
 
-    return df
+    headers = taxi_coord_headers(taxi_coord_type)
+    payment_labels = [PAYMENT_TYPE_LABELS[t] for t in payment_type]
+    weekday = [d.value - 1 for d in weekday]
+    if bitmap_index is not None:
+        for header, accepted in [
+            ("payment_type", payment_labels),
+            (headers["weekday"], weekday),
+            (headers["hour"], hour),
+        ]:
+            rows = rows[bitmap_contains(bitmap_index[header].select(accepted), rows)]
+    else:
+        rows = rows[df["payment_type"].take(rows).isin(payment_labels).to_numpy()]
+        rows = rows[
+            _isin_small_ints(df[headers["weekday"]].to_numpy()[rows], weekday, 7)
+        ]
+        rows = rows[_isin_small_ints(df[headers["hour"]].to_numpy()[rows], hour, 24)]
+
+    return rows.astype(np.int64)
+
+
+def filter_taxi_df(
+    df: pd.DataFrame,
+    taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP,
+    trip_distance: List[float] = None,
+    fare_amount: List[float] = None,
+    tip_amount: List[float] = None,
+    total_amount: List[float] = None,
+    payment_type: List[PaymentType] = None,
+    weekday: List[Weekday] = None,
+    hour: List[int] = None,
+    bitmap_index: Dict[str, BitmapIndex] = None,
+    range_index: Dict[str, SortedRangeIndex] = None,
+) -> pd.DataFrame:
+    """Filters the taxi trips, returning only the `longitude`, `latitude` and
+    `census_tract_idx` columns of the selected rows for `taxi_coord_type`.
+    The original DataFrame is left untouched and never copied as a whole."""
+    indices = filter_taxi_indices(
+        df,
+        taxi_coord_type,
+        trip_distance,
+        fare_amount,
+        tip_amount,
+        total_amount,
+        payment_type,
+        weekday,
+        hour,
+        bitmap_index,
+        range_index,
+    )
+    headers = taxi_coord_headers(taxi_coord_type)
+    return pd.DataFrame(
+        {
+            name: df[headers[name]].to_numpy()[indices]
+            for name in ["longitude", "latitude", "census_tract_idx"]
+        },
+        index=df.index[indices],
+    )
+
+
+def filter_pickup_dates(
+    df: pd.DataFrame, indices: np.ndarray, date_range: List[str] = None
+) -> np.ndarray:
+    """Keeps the positions in `indices` of the trips of `df` picked up from the
+    first to the last day of `date_range` ["YYYY-MM-DD", "YYYY-MM-DD"]. The
+    `pickup_datetime` column may hold timestamps or seconds since the epoch
+    (see `compact_taxi_df`)."""
+    if date_range is None:
+        return indices
+
+    start = pd.Timestamp(date_range[0])
+    end = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1)
+    values = df["pickup_datetime"].to_numpy()[indices]
+    if np.issubdtype(values.dtype, np.integer):
+        start, end = start.value // 10**9, end.value // 10**9
+    else:
+        start, end = start.to_datetime64(), end.to_datetime64()
+    return indices[(values >= start) & (values < end)]
+
+
+class IncrementalTaxiFilter:
+    """Filter of the taxi data remembering the mask of each predicate.
+
+    Every call compares the parameters of each predicate with the ones of the
+    previous call, recomputes only the masks of the predicates that changed,
+    and combines the cached masks. Dragging one slider thus costs a single
+    column comparison. Selective ranges still go through the range index,
+    see `filter_taxi_indices`. Keep one instance per user session.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        bitmap_index: Dict[str, BitmapIndex] = None,
+        range_index: Dict[str, SortedRangeIndex] = None,
+    ):
+        self.df = df
+        self.bitmap_index = bitmap_index
+        self.range_index = range_index
+        # {predicate_name: (params, mask)}
+        self.masks = dict()
+        self.last_recomputed = []
+
+    def _predicate_mask(self, name, params):
+        """Computes the mask of a predicate from its parameters"""
+        if name in RANGE_FILTER_HEADERS:
+            low, high = params
+            values = self.df[name].to_numpy()
+            mask = values >= low
+            mask &= values <= high
+            return mask
+
+        header, accepted = params
+        if self.bitmap_index is not None:
+            return unpack_bitmap(
+                self.bitmap_index[header].select(accepted), len(self.df)
+            )
+        if header == "payment_type":
+            return self.df[header].isin(accepted).to_numpy()
+        size = 7 if name == "weekday" else 24
+        return _isin_small_ints(self.df[header].to_numpy(), list(accepted), size)
+
+    def indices(
+        self,
+        taxi_coord_type: TaxiCoordType = TaxiCoordType.PICKUP,
+        trip_distance: List[float] = None,
+        fare_amount: List[float] = None,
+        tip_amount: List[float] = None,
+        total_amount: List[float] = None,
+        payment_type: List[PaymentType] = None,
+        weekday: List[Weekday] = None,
+        hour: List[int] = None,
+    ) -> np.ndarray:
+        """Same as `filter_taxi_indices`"""
+        _check_ranges(trip_distance, fare_amount, tip_amount, total_amount)
+        range_values = [trip_distance, fare_amount, tip_amount, total_amount]
+        ranges = dict(zip(RANGE_FILTER_HEADERS, range_values))
+
+        if self.range_index is not None and (
+            _range_plan(self.range_index, ranges, len(self.df)) is not None
+        ):
+            self.last_recomputed = []
+            return filter_taxi_indices(
+                self.df,
+                taxi_coord_type,
+                *range_values,
+                payment_type,
+                weekday,
+                hour,
+                self.bitmap_index,
+                self.range_index,
+            )
+
+        headers = taxi_coord_headers(taxi_coord_type)
+        params = {
+            header: (float(low), float(high)) for header, (low, high) in ranges.items()
+        }
+        params["payment_type"] = (
+            "payment_type",
+            tuple(sorted(PAYMENT_TYPE_LABELS[t] for t in payment_type)),
+        )
+        params["weekday"] = (
+            headers["weekday"],
+            tuple(sorted(d.value - 1 for d in weekday)),
+        )
+        params["hour"] = (headers["hour"], tuple(hour))
+
+        # Update a copy of the cached masks and swap it in at once, so calls
+        # overlapping in the threads of the server never combine the masks of
+        # different parameters
+        masks = dict(self.masks)
+        recomputed = []
+        for name, predicate_params in params.items():
+            cached = masks.get(name)
+            if cached is None or cached[0] != predicate_params:
+                masks[name] = (
+                    predicate_params,
+                    self._predicate_mask(name, predicate_params),
+                )
+                recomputed.append(name)
+        self.masks = masks
+        self.last_recomputed = recomputed
+
+        names = list(params)
+        mask = masks[names[0]][1].copy()
+        for name in names[1:]:
+            mask &= masks[name][1]
+        return np.flatnonzero(mask)
 
 
 def filter_popular_times(
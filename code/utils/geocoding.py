@@ -0,0 +1,266 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from shapely.geometry import box
+from shapely.prepared import prep
+from shapely.vectorized import contains
+
+
+def file_digest(*paths):
+    """Returns a SHA-256 hex digest of the contents of the given files"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_npz(path, compressed=False, **arrays):
+    """Saves arrays to a `.npz` file, replacing it at once.
+
+    The arrays are written to a temporary file in the same directory, which is
+    then renamed to `path`, so a concurrent reader never loads a partial file.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=".tmp_", suffix=".npz"
+    )
+    try:
+        with os.fdopen(fd, "wb") as file:
+            (np.savez_compressed if compressed else np.savez)(file, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class PolygonIndex:
+    """Spatial index for bulk point-in-polygon lookups over a dictionary of
+    polygons, e.g. `taxi_zone_polygons` or `census_tract_polygons`.
+
+    The polygon bounding boxes are packed into a single array and every polygon
+    is prepared once when the index is built. A query sorts the points by
+    longitude, so the candidate points of each polygon are found with two
+    binary searches and a latitude mask, and only those candidates are tested
+    with the exact (vectorized) `contains` predicate.
+
+    Lookups give the same answers as scanning the dictionary in order and
+    returning the first polygon that contains the point. Precomputed bounding
+    boxes (e.g. from the geometry cache) can be passed as `bounds`.
+    """
+
+    def __init__(self, polygons, bounds=None):
+        self.keys = list(polygons.keys())
+        self.polygons = list(polygons.values())
+        if bounds is None:
+            bounds = [poly.bounds for poly in self.polygons]
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self.prepared = [prep(poly) for poly in self.polygons]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def query(self, longitudes, latitudes):
+        """Returns the position of the first polygon containing each point,
+        or -1 if no polygon contains it.
+
+        Args:
+            longitudes: array-like
+                1D array of longitudes.
+            latitudes: array-like
+                1D array of latitudes with the same length as `longitudes`.
+        Return:
+            ndarray
+                1D array of `int` positions into `keys`.
+        """
+        x = np.asarray(longitudes, dtype=float)
+        y = np.asarray(latitudes, dtype=float)
+        assert (
+            x.shape == y.shape
+        ), "[ERROR] Longitudes and latitudes must have the same shape."
+
+        result = np.full(x.shape[0], -1, dtype=np.int64)
+        if x.shape[0] == 0 or len(self) == 0:
+            return result
+
+        # Sort the points once so that each bounding box maps to a contiguous
+        # slice of candidates (NaN coordinates are sorted last and never match)
+        order = np.argsort(x, kind="stable")
+        x_sorted = x[order]
+        lo = np.searchsorted(x_sorted, self.bounds[:, 0], side="left")
+        hi = np.searchsorted(x_sorted, self.bounds[:, 2], side="right")
+
+        for i in np.flatnonzero(hi > lo):
+            candidates = order[lo[i] : hi[i]]
+
+            # Keep the first match, as the sequential scan would
+            candidates = candidates[result[candidates] < 0]
+            candidate_y = y[candidates]
+            candidates = candidates[
+                (candidate_y >= self.bounds[i, 1]) & (candidate_y <= self.bounds[i, 3])
+            ]
+            if candidates.shape[0] == 0:
+                continue
+
+            inside = contains(self.prepared[i], x[candidates], y[candidates])
+            result[candidates[inside]] = i
+
+        return result
+
+    def intersecting(self, geom):
+        """Returns the positions of the polygons that intersect `geom`.
+
+        Polygons are rejected on their bounding boxes first, and the remaining
+        candidates are tested against `geom` prepared once.
+        """
+        minx, miny, maxx, maxy = geom.bounds
+        candidates = np.flatnonzero(
+            (self.bounds[:, 0] <= maxx)
+            & (self.bounds[:, 2] >= minx)
+            & (self.bounds[:, 1] <= maxy)
+            & (self.bounds[:, 3] >= miny)
+        )
+        prepared = prep(geom)
+        return np.array(
+            [i for i in candidates if prepared.intersects(self.polygons[i])],
+            dtype=np.int64,
+        )
+
+    def lookup(self, longitudes, latitudes, default=None):
+        """Returns the key of the polygon containing each point, or `default`
+        if no polygon contains it."""
+        keys = np.array(self.keys + [default])
+        return keys[self.query(longitudes, latitudes)]
+
+
+class RasterIndex:
+    """Quantized lat/lon lookup grid on top of a `PolygonIndex`.
+
+    Every cell of the grid records either the position of the only polygon
+    that contains the whole cell, `OUTSIDE` if no polygon touches the cell, or
+    `BOUNDARY` if the cell needs an exact test. A bulk query is then integer
+    array indexing, and only points in boundary cells (or outside the grid
+    extent) are passed on to the exact `PolygonIndex.query`.
+    """
+
+    OUTSIDE = -1
+    BOUNDARY = -2
+
+    def __init__(self, index, grid, origin, cell_size):
+        self.index = index
+        self.grid = grid
+        self.origin = np.asarray(origin, dtype=float)
+        self.cell_size = float(cell_size)
+
+    @classmethod
+    def build(cls, index, extent, cell_size):
+        """Rasterizes the polygons of `index` over `extent` (minx, miny, maxx, maxy).
+
+        The grid is refined quadtree-style: a block of cells is filled at once
+        when it is fully inside a single polygon or touches none, and is only
+        split down to single cells along polygon boundaries.
+        """
+        minx, miny, maxx, maxy = extent
+        nx = max(int(np.ceil((maxx - minx) / cell_size)), 1)
+        ny = max(int(np.ceil((maxy - miny) / cell_size)), 1)
+        grid = np.full((ny, nx), cls.OUTSIDE, dtype=np.int32)
+
+        # Grow every block slightly so that points rounded into a neighbouring
+        # cell are still covered by the classification of that cell
+        eps = cell_size * 1e-3
+
+        stack = [(0, nx, 0, ny, np.arange(len(index)))]
+        while stack:
+            x0, x1, y0, y1, candidates = stack.pop()
+            bx0 = minx + x0 * cell_size - eps
+            bx1 = minx + x1 * cell_size + eps
+            by0 = miny + y0 * cell_size - eps
+            by1 = miny + y1 * cell_size + eps
+
+            bounds = index.bounds[candidates]
+            candidates = candidates[
+                (bounds[:, 0] <= bx1)
+                & (bounds[:, 2] >= bx0)
+                & (bounds[:, 1] <= by1)
+                & (bounds[:, 3] >= by0)
+            ]
+            block = box(bx0, by0, bx1, by1)
+            candidates = np.array(
+                [i for i in candidates if index.prepared[i].intersects(block)],
+                dtype=np.int64,
+            )
+
+            if candidates.shape[0] == 0:
+                continue
+            if candidates.shape[0] == 1 and index.prepared[
+                candidates[0]
+            ].contains_properly(block):
+                grid[y0:y1, x0:x1] = candidates[0]
+                continue
+            if x1 - x0 == 1 and y1 - y0 == 1:
+                grid[y0, x0] = cls.BOUNDARY
+                continue
+
+            # Split the block in halves along each dimension longer than a cell
+            xs = [x0, (x0 + x1) // 2, x1] if x1 - x0 > 1 else [x0, x1]
+            ys = [y0, (y0 + y1) // 2, y1] if y1 - y0 > 1 else [y0, y1]
+            for xa, xb in zip(xs[:-1], xs[1:]):
+                for ya, yb in zip(ys[:-1], ys[1:]):
+                    stack.append((xa, xb, ya, yb, candidates))
+
+        return cls(index, grid, (minx, miny), cell_size)
+
+    def save(self, path, digest):
+        """Saves the grid to a `.npz` file tagged with the digest of its sources"""
+        save_npz(
+            path,
+            compressed=True,
+            grid=self.grid,
+            origin=self.origin,
+            cell_size=self.cell_size,
+            n_polygons=len(self.index),
+            digest=digest,
+        )
+
+    @classmethod
+    def load(cls, path, index, digest, cell_size):
+        """Loads a grid saved with `save`, or returns None if it is out of date"""
+        with np.load(path) as data:
+            if (
+                str(data["digest"]) != digest
+                or float(data["cell_size"]) != cell_size
+                or int(data["n_polygons"]) != len(index)
+            ):
+                return None
+            return cls(index, data["grid"], data["origin"], cell_size)
+
+    def query(self, longitudes, latitudes):
+        """Same as `PolygonIndex.query`, resolved from the grid where possible"""
+        x = np.asarray(longitudes, dtype=float)
+        y = np.asarray(latitudes, dtype=float)
+        assert (
+            x.shape == y.shape
+        ), "[ERROR] Longitudes and latitudes must have the same shape."
+
+        ix = np.floor((x - self.origin[0]) / self.cell_size)
+        iy = np.floor((y - self.origin[1]) / self.cell_size)
+        ny, nx = self.grid.shape
+        in_grid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+
+        result = np.full(x.shape[0], self.BOUNDARY, dtype=np.int64)
+        result[in_grid] = self.grid[
+            iy[in_grid].astype(np.intp), ix[in_grid].astype(np.intp)
+        ]
+
+        exact = result == self.BOUNDARY
+        if exact.any():
+            result[exact] = self.index.query(x[exact], y[exact])
+
+        return result
+
+    def lookup(self, longitudes, latitudes, default=None):
+        """Same as `PolygonIndex.lookup`, resolved from the grid where possible"""
+        keys = np.array(self.index.keys + [default])
+        return keys[self.query(longitudes, latitudes)]
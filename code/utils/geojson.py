@@ -0,0 +1,101 @@
+import json
+
+import numpy as np
+from shapely.geometry import mapping
+
+
+def zoom_tolerance(zoom):
+    """Returns the size of half a pixel in degrees at a Mapbox zoom level"""
+    # Mapbox GL renders 512px tiles, the whole world being 360 degrees wide at zoom 0
+    return 0.5 * 360 / (512 * 2**zoom)
+
+
+# Levels of detail of the tract GeoJSON as (min_zoom, tolerance, decimals):
+# the level is used from `min_zoom` on, its polygons are simplified with
+# `tolerance` degrees and its coordinates are rounded to `decimals`
+GEOJSON_LEVELS = [
+    (0, zoom_tolerance(10), 4),
+    (12, zoom_tolerance(12), 5),
+    (14, zoom_tolerance(14), 5),
+    (16, None, 6),
+]
+
+
+def level_for_zoom(zoom):
+    """Returns the position in `GEOJSON_LEVELS` of the level to render at `zoom`"""
+    level = 0
+    for i, (min_zoom, _, _) in enumerate(GEOJSON_LEVELS):
+        if zoom is not None and zoom >= min_zoom:
+            level = i
+    return level
+
+
+def _round_coordinates(coords, decimals):
+    """Rounds the (nested) coordinates of a GeoJSON geometry"""
+    if len(coords) and isinstance(coords[0][0], (int, float)):
+        return np.round(np.asarray(coords, dtype=float), decimals).tolist()
+    return [_round_coordinates(part, decimals) for part in coords]
+
+
+def create_geo_dict(polygons, tolerance=None, decimals=None):
+    """Creates a GeoJSON FeatureCollection from a dictionary of polygons.
+
+    Args:
+        polygons: dict
+            Dictionary of {id: polygon}.
+        tolerance: float
+            Simplification tolerance in degrees. Polygons are simplified with
+            `preserve_topology=True`, so they stay valid and keep their holes.
+        decimals: int
+            Number of decimals to round the coordinates to.
+    Return:
+        dict
+            GeoJSON FeatureCollection with one feature per polygon.
+    """
+    features = []
+    for idx, poly in polygons.items():
+        if tolerance:
+            poly = poly.simplify(tolerance, preserve_topology=True)
+        geo_obj = mapping(poly)
+        if decimals is not None:
+            geo_obj = {
+                "type": geo_obj["type"],
+                "coordinates": _round_coordinates(geo_obj["coordinates"], decimals),
+            }
+        features.append({"type": "Feature", "id": idx, "geometry": geo_obj})
+
+    geo_dict = {}
+    geo_dict["type"] = "FeatureCollection"
+    geo_dict["features"] = features
+    return geo_dict
+
+
+def payload_size(geo_dict):
+    """Returns the size in bytes of a GeoJSON object serialized to JSON"""
+    return len(json.dumps(geo_dict, separators=(",", ":")).encode("utf-8"))
+
+
+def main():
+    from utils.utils import get_geo_dict, get_geo_dict_levels
+
+    full_size = payload_size(get_geo_dict())
+    print(
+        "{:<10s} {:>10s} {:>12s} {:>8s}".format("Zoom", "Tolerance", "Bytes", "Saved")
+    )
+    print("{:<10s} {:>10s} {:>12d} {:>8s}".format("original", "-", full_size, "-"))
+    for (min_zoom, tolerance, _), geo_dict in zip(
+        GEOJSON_LEVELS, get_geo_dict_levels()
+    ):
+        size = payload_size(geo_dict)
+        print(
+            "{:<10s} {:>10.6f} {:>12d} {:>7.1f}%".format(
+                ">= {}".format(min_zoom),
+                tolerance or 0,
+                size,
+                100 * (1 - size / full_size),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
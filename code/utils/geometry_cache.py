@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+from shapely import wkb
+
+from utils.geocoding import file_digest, save_npz
+
+
+def save_geometry_cache(path, digest, geometries, **columns):
+    """Saves a dictionary of geometries to a `.npz` file.
+
+    The geometries are stored as one WKB buffer with offsets, next to their keys
+    and precomputed bounding boxes. Extra 1D `columns` (e.g. attributes read
+    from the same source file) are stored as is.
+
+    Args:
+        path: str
+            Path of the `.npz` file.
+        digest: str
+            Digest of the source files, see `file_digest`.
+        geometries: dict
+            Dictionary of {key: geometry}, where keys are `int` or `str`.
+    """
+    blobs = [wkb.dumps(geom) for geom in geometries.values()]
+    offsets = np.cumsum([0] + [len(blob) for blob in blobs])
+    bounds = np.array(
+        [geom.bounds for geom in geometries.values()], dtype=float
+    ).reshape(-1, 4)
+
+    save_npz(
+        path,
+        digest=digest,
+        keys=np.array(list(geometries.keys())),
+        wkb=np.frombuffer(b"".join(blobs), dtype=np.uint8),
+        offsets=offsets,
+        bounds=bounds,
+        **{"column_" + name: np.asarray(values) for name, values in columns.items()},
+    )
+
+
+def load_geometry_cache(path, digest):
+    """Loads a geometry cache saved with `save_geometry_cache`.
+
+    Return:
+        tuple or None
+            (geometries, bounds, columns), or None if the cache is missing or
+            was built from different source files.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        if str(data["digest"]) != digest:
+            return None
+
+        buffer = data["wkb"].tobytes()
+        offsets = data["offsets"]
+        geometries = {
+            key: wkb.loads(buffer[offsets[i] : offsets[i + 1]])
+            for i, key in enumerate(data["keys"].tolist())
+        }
+        columns = {
+            name[len("column_") :]: data[name]
+            for name in data.files
+            if name.startswith("column_")
+        }
+        return geometries, data["bounds"], columns
+
+
+def cached_geometries(cache_path, source_paths, parse_func):
+    """Returns the geometries parsed from `source_paths`, using the cache at
+    `cache_path` while the contents of the source files are unchanged.
+
+    Args:
+        cache_path: str
+            Path of the `.npz` cache file.
+        source_paths: list[str]
+            Paths of the files the geometries are parsed from.
+        parse_func: callable
+            Function without arguments returning (geometries, columns), called
+            to rebuild the cache.
+    Return:
+        tuple
+            (geometries, bounds, columns), see `load_geometry_cache`.
+    """
+    digest = file_digest(*source_paths)
+    cache = load_geometry_cache(cache_path, digest)
+
+    if cache is None:
+        print("[INFO] Building geometry cache: {}".format(cache_path))
+        geometries, columns = parse_func()
+        save_geometry_cache(cache_path, digest, geometries, **columns)
+        cache = load_geometry_cache(cache_path, digest)
+
+    return cache
@@ -0,0 +1,339 @@
+import time
+
+import numpy as np
+from numba import njit, prange
+
+# Number of cells along each axis of the candidate grid
+GRID_SIZE = 256
+
+
+def flatten_polygons(polygons):
+    """Flattens polygons and multipolygons (with holes) into coordinate arrays.
+
+    Return:
+        tuple
+            (vx, vy, ring_start, poly_ring_start), where the vertices of ring
+            `r` are `vx[ring_start[r]:ring_start[r + 1]]` and the rings of
+            polygon `i` are `poly_ring_start[i]` to `poly_ring_start[i + 1]`.
+    """
+    vx, vy = [], []
+    ring_start, poly_ring_start = [0], [0]
+    for poly in polygons:
+        parts = poly.geoms if hasattr(poly, "geoms") else [poly]
+        for part in parts:
+            for ring in [part.exterior, *part.interiors]:
+                coords = np.asarray(ring.coords, dtype=float)[:, :2]
+                vx.append(coords[:, 0])
+                vy.append(coords[:, 1])
+                ring_start.append(ring_start[-1] + coords.shape[0])
+        poly_ring_start.append(len(ring_start) - 1)
+
+    return (
+        np.concatenate(vx) if vx else np.empty(0),
+        np.concatenate(vy) if vy else np.empty(0),
+        np.array(ring_start, dtype=np.int64),
+        np.array(poly_ring_start, dtype=np.int64),
+    )
+
+
+def _strip_of(y, miny, maxy, n_strips):
+    """Returns the strip of each latitude in a bounding box split in `n_strips`"""
+    height = max((maxy - miny) / n_strips, 1e-12)
+    return np.clip(np.floor((y - miny) / height), 0, n_strips - 1).astype(np.int64)
+
+
+def build_edge_strips(vx, vy, ring_start, poly_ring_start, bounds, edges_per_strip=4):
+    """Buckets the edges of every polygon into horizontal strips of its bounding
+    box, so that a horizontal ray only meets the edges of one strip.
+
+    Return:
+        tuple
+            (strip_count, strip_start, strip_edge_start, strip_edges), where
+            polygon `i` has `strip_count[i]` strips starting at `strip_start[i]`,
+            and the edges of strip `s` (given by their first vertex) are
+            `strip_edges[strip_edge_start[s]:strip_edge_start[s + 1]]`.
+    """
+    n_polys = poly_ring_start.shape[0] - 1
+    strip_count = np.ones(n_polys, dtype=np.int64)
+    strip_start = np.zeros(n_polys + 1, dtype=np.int64)
+    strip_ids, edge_ids = [], []
+
+    for i in range(n_polys):
+        rings = range(poly_ring_start[i], poly_ring_start[i + 1])
+        edges = np.concatenate(
+            [np.arange(ring_start[r], ring_start[r + 1] - 1) for r in rings]
+            or [np.empty(0, dtype=np.int64)]
+        ).astype(np.int64)
+        strip_count[i] = min(max(edges.shape[0] // edges_per_strip, 1), 4096)
+        strip_start[i + 1] = strip_start[i] + strip_count[i]
+
+        # Same strip arithmetic as the kernel, see `_strip_of`
+        y0 = np.minimum(vy[edges], vy[edges + 1])
+        y1 = np.maximum(vy[edges], vy[edges + 1])
+        s0 = _strip_of(y0, bounds[i, 1], bounds[i, 3], strip_count[i])
+        s1 = _strip_of(y1, bounds[i, 1], bounds[i, 3], strip_count[i])
+        n_strips = s1 - s0 + 1
+
+        edge_ids.append(np.repeat(edges, n_strips))
+        offsets = np.arange(n_strips.sum()) - np.repeat(
+            np.cumsum(n_strips) - n_strips, n_strips
+        )
+        strip_ids.append(strip_start[i] + np.repeat(s0, n_strips) + offsets)
+
+    strip_ids = np.concatenate(strip_ids) if strip_ids else np.empty(0, np.int64)
+    edge_ids = np.concatenate(edge_ids) if edge_ids else np.empty(0, np.int64)
+    order = np.argsort(strip_ids, kind="stable")
+    strip_edge_start = np.searchsorted(
+        strip_ids[order], np.arange(strip_start[-1] + 1)
+    ).astype(np.int64)
+    return strip_count, strip_start, strip_edge_start, edge_ids[order]
+
+
+@njit(parallel=True, cache=True)
+def _query_kernel(
+    x,
+    y,
+    origin,
+    cell_size,
+    grid_shape,
+    cell_start,
+    cell_polys,
+    bounds,
+    strip_count,
+    strip_start,
+    strip_edge_start,
+    strip_edges,
+    vx,
+    vy,
+    result,
+):
+    """Even-odd ray casting of every point against its candidate polygons"""
+    nx, ny = grid_shape[0], grid_shape[1]
+    for k in prange(x.shape[0]):
+        px = x[k]
+        py = y[k]
+        result[k] = -1
+        if not (px == px and py == py):
+            continue
+
+        ix = int(np.floor((px - origin[0]) / cell_size[0]))
+        iy = int(np.floor((py - origin[1]) / cell_size[1]))
+        if ix < 0 or ix >= nx or iy < 0 or iy >= ny:
+            continue
+
+        cell = iy * nx + ix
+        for c in range(cell_start[cell], cell_start[cell + 1]):
+            i = cell_polys[c]
+            if (
+                px < bounds[i, 0]
+                or px > bounds[i, 2]
+                or py < bounds[i, 1]
+                or py > bounds[i, 3]
+            ):
+                continue
+
+            # Only the edges of the strip containing the point can cross its
+            # horizontal ray. Counting crossings over the edges of all rings
+            # handles holes and multipolygons.
+            height = max((bounds[i, 3] - bounds[i, 1]) / strip_count[i], 1e-12)
+            strip = int(np.floor((py - bounds[i, 1]) / height))
+            strip = strip_start[i] + min(max(strip, 0), strip_count[i] - 1)
+
+            inside = False
+            for e in range(strip_edge_start[strip], strip_edge_start[strip + 1]):
+                v = strip_edges[e]
+                x1 = vx[v]
+                y1 = vy[v]
+                x2 = vx[v + 1]
+                y2 = vy[v + 1]
+                if (y1 > py) != (y2 > py):
+                    if px < (x2 - x1) * (py - y1) / (y2 - y1) + x1:
+                        inside = not inside
+
+            if inside:
+                result[k] = i
+                break
+
+
+class NumbaPolygonIndex:
+    """JIT-compiled alternative to `PolygonIndex` with the same interface.
+
+    The polygons are flattened into coordinate arrays, and a uniform grid over
+    their extent lists the candidate polygons of every cell in order. The edges
+    of every polygon are bucketed into horizontal strips. Points are processed
+    in parallel across cores, each one ray casting only against the edges in
+    its strip of the candidates of its cell.
+
+    Results match `PolygonIndex` except for points lying exactly on a polygon
+    boundary, which ray casting does not resolve like shapely's `contains`.
+    """
+
+    def __init__(self, polygons, bounds=None, grid_size=GRID_SIZE):
+        self.keys = list(polygons.keys())
+        self.polygons = list(polygons.values())
+        if bounds is None:
+            bounds = [poly.bounds for poly in self.polygons]
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self.vx, self.vy, ring_start, poly_ring_start = flatten_polygons(self.polygons)
+        (
+            self.strip_count,
+            self.strip_start,
+            self.strip_edge_start,
+            self.strip_edges,
+        ) = build_edge_strips(
+            self.vx, self.vy, ring_start, poly_ring_start, self.bounds
+        )
+        self._build_grid(grid_size)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _build_grid(self, grid_size):
+        """Builds the candidate grid as CSR arrays (cell_start, cell_polys)"""
+        if len(self) == 0:
+            self.origin = np.zeros(2)
+            self.cell_size = np.ones(2)
+            self.grid_shape = np.ones(2, dtype=np.int64)
+            self.cell_start = np.zeros(2, dtype=np.int64)
+            self.cell_polys = np.empty(0, dtype=np.int64)
+            return
+
+        minx, miny = self.bounds[:, :2].min(axis=0)
+        maxx, maxy = self.bounds[:, 2:].max(axis=0)
+        self.origin = np.array([minx, miny])
+        self.cell_size = np.array(
+            [
+                max((maxx - minx) / grid_size, 1e-12),
+                max((maxy - miny) / grid_size, 1e-12),
+            ]
+        )
+        self.grid_shape = np.array([grid_size, grid_size], dtype=np.int64)
+
+        # Same cell arithmetic as the kernel, so a point inside a bounding box
+        # always falls in a cell listing that polygon
+        cells = np.floor(
+            (self.bounds.reshape(-1, 2, 2) - self.origin) / self.cell_size
+        ).astype(np.int64)
+        cells = np.clip(cells, 0, grid_size - 1)
+
+        cell_ids, poly_ids = [], []
+        for i, ((ix0, iy0), (ix1, iy1)) in enumerate(cells):
+            ix, iy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1))
+            cell_ids.append((iy * grid_size + ix).ravel())
+            poly_ids.append(np.full(cell_ids[-1].shape[0], i, dtype=np.int64))
+        cell_ids = np.concatenate(cell_ids)
+        poly_ids = np.concatenate(poly_ids)
+
+        # Sort by cell, then by polygon position to keep the first match
+        order = np.lexsort((poly_ids, cell_ids))
+        self.cell_start = np.searchsorted(
+            cell_ids[order], np.arange(grid_size * grid_size + 1)
+        ).astype(np.int64)
+        self.cell_polys = poly_ids[order]
+
+    def query(self, longitudes, latitudes):
+        """Same as `PolygonIndex.query`"""
+        x = np.ascontiguousarray(longitudes, dtype=float)
+        y = np.ascontiguousarray(latitudes, dtype=float)
+        assert (
+            x.shape == y.shape
+        ), "[ERROR] Longitudes and latitudes must have the same shape."
+
+        result = np.empty(x.shape[0], dtype=np.int64)
+        _query_kernel(
+            x,
+            y,
+            self.origin,
+            self.cell_size,
+            self.grid_shape,
+            self.cell_start,
+            self.cell_polys,
+            self.bounds,
+            self.strip_count,
+            self.strip_start,
+            self.strip_edge_start,
+            self.strip_edges,
+            self.vx,
+            self.vy,
+            result,
+        )
+        return result
+
+    def lookup(self, longitudes, latitudes, default=None):
+        """Same as `PolygonIndex.lookup`"""
+        keys = np.array(self.keys + [default])
+        return keys[self.query(longitudes, latitudes)]
+
+
+def main():
+    """Benchmarks the numba backend against the shapely backend and checks that
+    both give the same answers on the sample taxi data"""
+    import pandas as pd
+
+    import utils.utils as utils
+
+    samples = [
+        "./data/sample/sample_manhattan_taxi_2014_nov.csv",
+        "./data/sample/sample_manhattan_taxi_2021_nov_final.csv",
+    ]
+    df = pd.concat(
+        [pd.read_csv(path, engine="pyarrow") for path in samples], ignore_index=True
+    )
+    df = pd.DataFrame(
+        {
+            "pickup_longitude": np.concatenate(
+                [df["pickup_longitude"], df["dropoff_longitude"]]
+            ),
+            "pickup_latitude": np.concatenate(
+                [df["pickup_latitude"], df["dropoff_latitude"]]
+            ),
+        }
+    )
+
+    # Synthetic points over Manhattan for throughput
+    rng = np.random.default_rng(0)
+    n_points = 1000000
+    bench_df = pd.DataFrame(
+        {
+            "pickup_longitude": rng.uniform(-74.03, -73.90, n_points),
+            "pickup_latitude": rng.uniform(40.69, 40.88, n_points),
+        }
+    )
+
+    funcs = [
+        utils.batch_coordinate_to_zone,
+        utils.batch_coordinate_to_borough,
+        utils.batch_coordinate_in_manhattan,
+        utils.batch_coordinate_to_census_tract,
+    ]
+    n_mismatches = 0
+    for func in funcs:
+        expected = func(df, backend="index")
+        actual = func(df, backend="numba")
+        mismatches = int((expected != actual).sum())
+        n_mismatches += mismatches
+
+        timings = []
+        for backend in ["index", "numba"]:
+            start = time.perf_counter()
+            func(bench_df, backend=backend)
+            timings.append(time.perf_counter() - start)
+
+        print(
+            "{:<40s} mismatches: {:d}/{:d}  shapely: {:.3f}s  numba: {:.3f}s  "
+            "({:.1f}M points/s)".format(
+                func.__name__,
+                mismatches,
+                len(df),
+                timings[0],
+                timings[1],
+                n_points / timings[1] / 1e6,
+            )
+        )
+
+    if n_mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from utils.filtering import Weekday
+from utils.utils import vectorize_popularity
+
+
+class PopularTimesTensor:
+    """Popular times of all places as one contiguous array.
+
+    `tensor` has shape [n_places, 7, 24], and `place_tract_codes` gives the
+    position in `tract_ids` of the census tract of every place, so per-tract
+    reductions are a `bincount` over the places.
+
+    `tract_prefix_sums` has shape [n_tracts, 7, 25] and holds the popularity
+    of the places of each tract summed over the hours before each hour, so
+    the sum over a contiguous hour range is the difference of two entries.
+    """
+
+    def __init__(self, popular_times_df: pd.DataFrame):
+        if len(popular_times_df):
+            self.tensor = np.stack(
+                popular_times_df["populartimes"].apply(vectorize_popularity)
+            )
+        else:
+            self.tensor = np.zeros((0, 7, 24), dtype=np.int64)
+        self.tract_ids, self.place_tract_codes = np.unique(
+            popular_times_df["census_tract_idx"].to_numpy(), return_inverse=True
+        )
+        self.places_per_tract = np.bincount(
+            self.place_tract_codes, minlength=self.tract_ids.shape[0]
+        )
+
+        tract_sums = np.zeros((self.tract_ids.shape[0], 7, 24), dtype=np.int64)
+        np.add.at(tract_sums, self.place_tract_codes, self.tensor)
+        self.tract_prefix_sums = np.zeros(
+            (self.tract_ids.shape[0], 7, 25), dtype=np.int64
+        )
+        np.cumsum(tract_sums, axis=2, out=self.tract_prefix_sums[:, :, 1:])
+
+    def __len__(self):
+        return self.tensor.shape[0]
+
+    def tract_popularity(
+        self, weekday: List[Weekday] = None, hour: List[int] = None
+    ) -> pd.Series:
+        """Returns the mean popularity of the places of each census tract over
+        the selected weekdays and hours, as a Series {census_tract_idx: value}.
+
+        This is the value computed by `join_taxi_with_pt_df` from the output of
+        `filter_popular_times`: the mean over the places of a tract of the mean
+        over the selected cells of their popular times.
+        """
+        weekday = np.array([d.value - 1 for d in weekday], dtype=np.int64)
+        hour = np.array(hour, dtype=np.int64)
+
+        if hour.size and np.array_equal(hour, np.arange(hour[0], hour[-1] + 1)):
+            # Contiguous hour range, as selected by the hour slider
+            prefix_sums = self.tract_prefix_sums[:, weekday]
+            tract_sums = (
+                prefix_sums[:, :, hour[-1] + 1] - prefix_sums[:, :, hour[0]]
+            ).sum(axis=1)
+        else:
+            selected = self.tensor[:, weekday[:, None], hour[None, :]]
+            place_sums = selected.reshape(len(self), -1).sum(axis=1)
+            tract_sums = np.bincount(
+                self.place_tract_codes,
+                weights=place_sums,
+                minlength=self.tract_ids.shape[0],
+            )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            popularity = tract_sums / (self.places_per_tract * weekday.size * hour.size)
+
+        return pd.Series(popularity, index=self.tract_ids, name="popularity")
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+
+class SortedRangeIndex:
+    """Sorted copy of a numerical column next to the ids of its rows, so the
+    rows with a value in [low, high] are found with two binary searches"""
+
+    def __init__(self, values):
+        values = pd.Series(values).to_numpy()
+        self.n_rows = values.shape[0]
+        order = np.argsort(values, kind="stable")
+        row_dtype = np.int32 if self.n_rows < np.iinfo(np.int32).max else np.int64
+        self.row_ids = order.astype(row_dtype)
+        self.sorted_values = values[order]
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def nbytes(self):
+        """Memory used by the index in bytes"""
+        return self.row_ids.nbytes + self.sorted_values.nbytes
+
+    def bounds(self, low, high):
+        """Returns the slice (start, stop) of the sorted rows with a value in
+        [low, high], comparing in the dtype of the column like a mask would"""
+        low, high = np.array([low, high]).astype(self.sorted_values.dtype)
+        start = np.searchsorted(self.sorted_values, low, side="left")
+        stop = np.searchsorted(self.sorted_values, high, side="right")
+        return start, max(start, stop)
+
+    def count(self, low, high):
+        """Returns the number of rows with a value in [low, high]"""
+        start, stop = self.bounds(low, high)
+        return stop - start
+
+    def rows(self, low, high):
+        """Returns the sorted ids of the rows with a value in [low, high]"""
+        start, stop = self.bounds(low, high)
+        return np.sort(self.row_ids[start:stop])
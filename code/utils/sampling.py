@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from utils.filtering import (
+    TaxiCoordType,
+    filter_pickup_dates,
+    filter_taxi_indices,
+    taxi_coord_headers,
+)
+
+
+class StratifiedTripSample:
+    """Stratified sample of the taxi trips for approximate per-tract counts.
+
+    For each coordinate type, the trips are split in strata by census tract and
+    hour, and `fraction` of the trips of every stratum (at least one) are drawn
+    at random. Every sampled trip weighs the number of trips of its stratum
+    divided by the number drawn from it, so the weighted counts of the sampled
+    trips passing a filter estimate the exact counts.
+    """
+
+    def __init__(self, df: pd.DataFrame, fraction=0.05, seed=0):
+        self.fraction = fraction
+        rng = np.random.default_rng(seed)
+        self.samples = dict()
+
+        for taxi_coord_type in TaxiCoordType:
+            headers = taxi_coord_headers(taxi_coord_type)
+            strata = df.groupby(
+                [headers["census_tract_idx"], headers["hour"]], sort=False, dropna=False
+            ).ngroup()
+            strata = strata.to_numpy()
+            stratum_sizes = np.bincount(strata)
+            quotas = np.maximum(np.ceil(stratum_sizes * fraction), 1).astype(np.int64)
+
+            # Shuffle, then keep the first `quota` trips of every stratum
+            order = rng.permutation(len(df))
+            order = order[np.argsort(strata[order], kind="stable")]
+            stratum_starts = np.concatenate([[0], np.cumsum(stratum_sizes)[:-1]])
+            ranks = np.arange(len(df)) - stratum_starts[strata[order]]
+            rows = np.sort(order[ranks < quotas[strata[order]]])
+
+            weights = stratum_sizes[strata[rows]] / quotas[strata[rows]]
+            self.samples[taxi_coord_type] = (
+                df.iloc[rows].reset_index(drop=True),
+                weights,
+            )
+
+    def __len__(self):
+        return len(self.samples[TaxiCoordType.PICKUP][0])
+
+    def tract_counts(self, taxi_coord_type: TaxiCoordType, *filters, date_range=None):
+        """Returns the estimated number of trips per census tract selected by
+        the same filters as `filter_taxi_df` and the pickup `date_range` (see
+        `filter_pickup_dates`), as a Series {census_tract_idx: count} of the
+        tracts with sampled trips passing the filters"""
+        sample, weights = self.samples[taxi_coord_type]
+        indices = filter_taxi_indices(sample, taxi_coord_type, *filters)
+        indices = filter_pickup_dates(sample, indices, date_range)
+        tract_idx = sample[taxi_coord_headers(taxi_coord_type)["census_tract_idx"]]
+        counts = (
+            pd.Series(weights[indices], index=tract_idx.to_numpy()[indices])
+            .groupby(level=0)
+            .sum()
+        )
+        return counts.round().astype(np.int64).rename("census_tract_idx")
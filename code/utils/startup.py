@@ -0,0 +1,120 @@
+import argparse
+import functools
+import json
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+# Time spent loading each dataset in this process: {dataset_name: seconds}
+dataset_load_times = dict()
+
+# Stack of the time spent in nested loads of the datasets being loaded
+_nested_load_times = []
+
+
+@contextmanager
+def timed_load(name):
+    """Records the time spent in the block as the load time of dataset `name`,
+    excluding the time spent loading other datasets inside the block"""
+    _nested_load_times.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        dataset_load_times[name] = elapsed - _nested_load_times.pop()
+        if _nested_load_times:
+            _nested_load_times[-1] += elapsed
+
+
+def lazy_dataset(func):
+    """Decorator for dataset accessors without arguments: the dataset is loaded
+    on the first call, timed with `timed_load`, and cached afterwards"""
+    name = func.__name__.replace("get_", "", 1)
+
+    @functools.wraps(func)
+    def wrapper():
+        if not hasattr(wrapper, "_value"):
+            with timed_load(name):
+                wrapper._value = func()
+            print(
+                "[DEBUG] Loaded {} in {:.3f}s.".format(name, dataset_load_times[name])
+            )
+        return wrapper._value
+
+    return wrapper
+
+
+def _parse_importtime(stderr, module):
+    """Returns [(name, cumulative_seconds)] of the modules imported directly by
+    `module`, parsed from the output of `python -X importtime`"""
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0 and name == module:
+            return children
+        if depth == 0:
+            children = []
+        elif depth == 1:
+            children.append((name, int(cumulative) / 1e6))
+    return children
+
+
+def main(args):
+    # Import the app in a fresh interpreter to measure a real cold start
+    script = (
+        "import json, time\n"
+        "start = time.perf_counter()\n"
+        "import {module}\n"
+        "total = time.perf_counter() - start\n"
+        "from utils.startup import dataset_load_times\n"
+        "print(json.dumps({{'total': total, 'datasets': dataset_load_times}}))\n"
+    ).format(module=args.module)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr)
+        sys.exit(proc.returncode)
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    modules = sorted(_parse_importtime(proc.stderr, args.module), key=lambda x: -x[1])
+    datasets = sorted(result["datasets"].items(), key=lambda x: -x[1])
+
+    print("Cold start of `{}`: {:.3f}s".format(args.module, result["total"]))
+    print("\nImport cost per module (cumulative):")
+    for name, seconds in modules[: args.top]:
+        print("  {:<40s} {:8.3f}s".format(name, seconds))
+    print("\nLoad cost per dataset:")
+    for name, seconds in datasets:
+        print("  {:<40s} {:8.3f}s".format(name, seconds))
+
+    if args.budget is not None and result["total"] > args.budget:
+        print("\n[ERROR] Cold start exceeds the budget of {:.3f}s.".format(args.budget))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold Start Report")
+
+    parser.add_argument("--module", default="app", help="Module to import.")
+    parser.add_argument(
+        "--top", default=15, type=int, help="Number of modules to list."
+    )
+    parser.add_argument(
+        "--budget", default=None, type=float, help="Cold start budget in seconds."
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -1,66 +1,282 @@
-from multiprocessing import Pool
+import os
+import time
+from multiprocessing import Pool, get_start_method
 
-import geopandas as gpd
 import numpy as np
 import pandas as pd
 from shapely import wkt
-from shapely.geometry import Point, Polygon, mapping
-
-# Read taxi zone polygon data
-taxi_zone_df = pd.read_csv("./data/supplementary/nyc_taxi_zones.csv", engine="pyarrow")
-
-# Build a dictionary of taxi zone polygons: {zone_id: polygon}
-taxi_zone_polygons = dict()
-for i, row in taxi_zone_df.iterrows():
-    poly = Polygon(eval(row["the_geom"])["coordinates"][0][0])
-    zone_id = row["location_id"]
-    taxi_zone_polygons[zone_id] = poly
-
-# Read borough boundaries
-# No `pyarrow` engine used. Due to error:
-# ArrowInvalid: straddling object straddles two block boundaries (try to increase block size?)
-borough_boundary_df = pd.read_csv("./data/supplementary/nyc_borough_boundaries.csv")
-borough_boundary_df["the_geom"] = borough_boundary_df["the_geom"].apply(wkt.loads)
-
-# Build a dictionary of borough boundaries: {borough_name: polygon}
-borough_polygons = dict()
-for i, row in borough_boundary_df.iterrows():
-    poly = row["the_geom"]
-    boro_name = row["BoroName"]
-    borough_polygons[boro_name] = poly
-
-# Build a dictionary of borough boundaries: {borough_name: set(zone_id)}
-borough_zone_ids = (
-    taxi_zone_df.groupby("borough")["location_id"].agg(set=set).to_dict()["set"]
-)
+from shapely.geometry import Point, Polygon
+
+# This module is also imported as the top-level `utils` module, with
+# ./code/utils/ on the path, by ./code/data/data_cleaning.py. Its sibling
+# modules are then found as submodules of it, like in the `utils` package.
+if not __package__:
+    __path__ = [os.path.dirname(os.path.abspath(__file__))]
 
-# Read census tracts
-census_tracts_df = pd.read_csv(
-    "./data/supplementary/nyc_census_tracts_2020.csv", engine="pyarrow"
+from utils.startup import lazy_dataset  # noqa: E402
+
+SUPPLEMENTARY_DATA_ROOT = "./data/supplementary"
+TAXI_ZONES_PATH = os.path.join(SUPPLEMENTARY_DATA_ROOT, "nyc_taxi_zones.csv")
+BOROUGH_BOUNDARIES_PATH = os.path.join(
+    SUPPLEMENTARY_DATA_ROOT, "nyc_borough_boundaries.csv"
 )
-census_tracts_df["the_geom"] = census_tracts_df["the_geom"].apply(wkt.loads)
-
-# Build a dictionary of census tracts: {index: polygon}
-census_tract_polygons = dict()
-for i, row in census_tracts_df.iterrows():
-    poly = row["the_geom"]
-    census_tract_polygons[i] = poly
-
-# Build a dictionary of census tracts in Manhattan: {index: polygon}
-manhanttan_tract_polys = {
-    tract_idx: poly
-    for tract_idx, poly in census_tract_polygons.items()
-    if poly.intersection(borough_polygons["Manhattan"])
+CENSUS_TRACTS_PATH = os.path.join(SUPPLEMENTARY_DATA_ROOT, "nyc_census_tracts_2020.csv")
+
+# Size of a raster lookup grid cell in degrees (about 50 meters)
+RASTER_CELL_SIZE = 0.0005
+
+
+def _parse_taxi_zones():
+    """Parses the taxi zone CSV into {zone_id: polygon} and the borough of each zone"""
+    taxi_zone_df = pd.read_csv(TAXI_ZONES_PATH, engine="pyarrow")
+
+    taxi_zone_polygons = dict()
+    for i, row in taxi_zone_df.iterrows():
+        poly = Polygon(eval(row["the_geom"])["coordinates"][0][0])
+        zone_id = row["location_id"]
+        taxi_zone_polygons[zone_id] = poly
+
+    columns = {
+        "location_id": taxi_zone_df["location_id"].to_numpy(),
+        "borough": taxi_zone_df["borough"].to_numpy().astype(str),
+    }
+    return taxi_zone_polygons, columns
+
+
+def _parse_borough_boundaries():
+    """Parses the borough boundary CSV into {borough_name: polygon}"""
+    # No `pyarrow` engine used. Due to error:
+    # ArrowInvalid: straddling object straddles two block boundaries (try to increase block size?)
+    borough_boundary_df = pd.read_csv(BOROUGH_BOUNDARIES_PATH)
+
+    borough_polygons = dict()
+    for boro_name, geom in zip(
+        borough_boundary_df["BoroName"], borough_boundary_df["the_geom"]
+    ):
+        borough_polygons[boro_name] = wkt.loads(geom)
+    return borough_polygons, {}
+
+
+def _parse_census_tracts():
+    """Parses the census tract CSV into {index: polygon}"""
+    census_tracts_df = pd.read_csv(CENSUS_TRACTS_PATH, engine="pyarrow")
+
+    census_tract_polygons = dict()
+    for i, geom in zip(census_tracts_df.index, census_tracts_df["the_geom"]):
+        census_tract_polygons[i] = wkt.loads(geom)
+    return census_tract_polygons, {}
+
+
+def _cached_geometries(name, source_paths, parse_func):
+    """Loads the geometry set `name` through the geometry cache"""
+    from utils.geometry_cache import cached_geometries
+
+    cache_path = os.path.join(SUPPLEMENTARY_DATA_ROOT, "{}_geometry.npz".format(name))
+    return cached_geometries(cache_path, source_paths, parse_func)
+
+
+@lazy_dataset
+def get_taxi_zones():
+    """Returns taxi zone polygons {zone_id: polygon}, their bounding boxes and
+    the zone attribute columns"""
+    return _cached_geometries("taxi_zone", [TAXI_ZONES_PATH], _parse_taxi_zones)
+
+
+@lazy_dataset
+def get_boroughs():
+    """Returns borough boundaries {borough_name: polygon} and their bounding boxes"""
+    polygons, bounds, _ = _cached_geometries(
+        "borough", [BOROUGH_BOUNDARIES_PATH], _parse_borough_boundaries
+    )
+    return polygons, bounds
+
+
+@lazy_dataset
+def get_census_tracts():
+    """Returns census tract polygons {index: polygon} and their bounding boxes"""
+    polygons, bounds, _ = _cached_geometries(
+        "census_tract", [CENSUS_TRACTS_PATH], _parse_census_tracts
+    )
+    return polygons, bounds
+
+
+def get_taxi_zone_polygons():
+    """Returns a dictionary of taxi zone polygons: {zone_id: polygon}"""
+    return get_taxi_zones()[0]
+
+
+def get_borough_polygons():
+    """Returns a dictionary of borough boundaries: {borough_name: polygon}"""
+    return get_boroughs()[0]
+
+
+def get_census_tract_polygons():
+    """Returns a dictionary of census tracts: {index: polygon}"""
+    return get_census_tracts()[0]
+
+
+@lazy_dataset
+def get_borough_zone_ids():
+    """Returns a dictionary of borough boundaries: {borough_name: set(zone_id)}"""
+    columns = get_taxi_zones()[2]
+    return (
+        pd.Series(columns["location_id"]).groupby(columns["borough"]).agg(set).to_dict()
+    )
+
+
+@lazy_dataset
+def get_borough_tract_membership():
+    """Returns a dictionary of census tracts intersecting each borough:
+    {borough_name: list(tract_idx)}
+
+    The membership table is saved to `SUPPLEMENTARY_DATA_ROOT` and rebuilt
+    whenever the contents of the census tract or borough CSVs change.
+    """
+    from utils.geocoding import file_digest, save_npz
+
+    membership_path = os.path.join(
+        SUPPLEMENTARY_DATA_ROOT, "borough_tract_membership.npz"
+    )
+    digest = file_digest(CENSUS_TRACTS_PATH, BOROUGH_BOUNDARIES_PATH)
+
+    if os.path.exists(membership_path):
+        with np.load(membership_path) as data:
+            if str(data["digest"]) == digest:
+                boroughs = data["borough"].tolist()
+                tract_ids = data["tract_idx"].tolist()
+                membership = {boro_name: [] for boro_name in get_borough_polygons()}
+                for boro_name, tract_idx in zip(boroughs, tract_ids):
+                    membership[boro_name].append(tract_idx)
+                return membership
+
+    print("[INFO] Building borough tract membership: {}".format(membership_path))
+    index = get_census_tract_index()
+    membership = {
+        boro_name: [index.keys[i] for i in index.intersecting(poly)]
+        for boro_name, poly in get_borough_polygons().items()
+    }
+    save_npz(
+        membership_path,
+        digest=digest,
+        borough=np.array(
+            [boro_name for boro_name, ids in membership.items() for _ in ids],
+            dtype=str,
+        ),
+        tract_idx=np.array(
+            [tract_idx for ids in membership.values() for tract_idx in ids],
+            dtype=np.int64,
+        ),
+    )
+    return membership
+
+
+def get_borough_tract_polys(boro_name):
+    """Returns a dictionary of census tracts in a borough: {index: polygon}"""
+    census_tract_polygons = get_census_tract_polygons()
+    return {
+        tract_idx: census_tract_polygons[tract_idx]
+        for tract_idx in get_borough_tract_membership()[boro_name]
+    }
+
+
+@lazy_dataset
+def get_manhattan_tract_polys():
+    """Returns a dictionary of census tracts in Manhattan: {index: polygon}"""
+    return get_borough_tract_polys("Manhattan")
+
+
+@lazy_dataset
+def get_geo_dict():
+    """Returns a GeoJSON FeatureCollection of the census tracts in Manhattan"""
+    from utils.geojson import create_geo_dict
+
+    return create_geo_dict(get_manhattan_tract_polys())
+
+
+@lazy_dataset
+def get_geo_dict_levels():
+    """Returns simplified GeoJSON FeatureCollections of the census tracts in
+    Manhattan, one per level of `utils.geojson.GEOJSON_LEVELS`"""
+    from utils.geojson import GEOJSON_LEVELS, create_geo_dict
+
+    polygons = get_manhattan_tract_polys()
+    return [
+        create_geo_dict(polygons, tolerance, decimals)
+        for _, tolerance, decimals in GEOJSON_LEVELS
+    ]
+
+
+def get_geo_dict_for_zoom(zoom):
+    """Returns the simplified GeoJSON of the census tracts in Manhattan suited
+    to a Mapbox zoom level"""
+    from utils.geojson import level_for_zoom
+
+    return get_geo_dict_levels()[level_for_zoom(zoom)]
+
+
+@lazy_dataset
+def get_taxi_zone_index():
+    """Returns the spatial index of taxi zones for bulk coordinate lookups"""
+    from utils.geocoding import PolygonIndex
+
+    polygons, bounds, _ = get_taxi_zones()
+    return PolygonIndex(polygons, bounds)
+
+
+@lazy_dataset
+def get_borough_index():
+    """Returns the spatial index of boroughs for bulk coordinate lookups"""
+    from utils.geocoding import PolygonIndex
+
+    return PolygonIndex(*get_boroughs())
+
+
+@lazy_dataset
+def get_manhattan_index():
+    """Returns the spatial index of the Manhattan boundary for bulk coordinate lookups"""
+    from utils.geocoding import PolygonIndex
+
+    return PolygonIndex({"Manhattan": get_borough_polygons()["Manhattan"]})
+
+
+@lazy_dataset
+def get_census_tract_index():
+    """Returns the spatial index of census tracts for bulk coordinate lookups"""
+    from utils.geocoding import PolygonIndex
+
+    return PolygonIndex(*get_census_tracts())
+
+
+# Datasets exposed as module attributes, loaded on first access
+_lazy_attributes = {
+    "taxi_zone_polygons": get_taxi_zone_polygons,
+    "borough_polygons": get_borough_polygons,
+    "borough_zone_ids": get_borough_zone_ids,
+    "census_tract_polygons": get_census_tract_polygons,
+    "manhanttan_tract_polys": get_manhattan_tract_polys,
+    "geo_dict": get_geo_dict,
+    "taxi_zone_index": get_taxi_zone_index,
+    "borough_index": get_borough_index,
+    "manhattan_index": get_manhattan_index,
+    "census_tract_index": get_census_tract_index,
 }
 
-# Create a GeoJSON
-geo_objs = {idx: mapping(poly) for idx, poly in manhanttan_tract_polys.items()}
-geo_dict = {}
-geo_dict["type"] = "FeatureCollection"
-geo_dict["features"] = [
-    {"type": "Feature", "id": idx, "geometry": geo_obj}
-    for idx, geo_obj in geo_objs.items()
-]
+# Raster lookup grids, loaded on first use by `get_raster_index`
+_raster_indices = dict()
+
+# Numba lookup indices, built on first use by `get_numba_index`
+_numba_indices = dict()
+
+# Per-borough lookup indices, built on first use by `get_borough_sub_indices`
+_borough_sub_indices = dict()
+
+# Spatial index accessors of each geometry set, see `get_lookup_index`
+_polygon_indices = {
+    "taxi_zone": get_taxi_zone_index,
+    "borough": get_borough_index,
+    "manhattan": get_manhattan_index,
+    "census_tract": get_census_tract_index,
+}
 
 # # Read street centerlines
 # street_centerlines_df = gpd.read_file("./data/supplementary/nyc_street_centerlines.geojson")
@@ -70,89 +286,364 @@ geo_dict["features"] = [
 #     street_centerlines_df["geometry"].sample(50000).geometry.unary_union
 # )
 
-print("[DEBUG] utils.py: Finished loading supplementary data to memory.")
+
+def __getattr__(name):
+    """Loads the datasets in `_lazy_attributes` when accessed as module attributes"""
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def get_raster_index(name):
+    """Returns the raster lookup grid of `taxi_zone` or `census_tract`.
+
+    The grid is saved next to the source CSVs in `SUPPLEMENTARY_DATA_ROOT` and
+    rebuilt whenever the contents of the source CSVs change. Taxi zones are
+    rasterized over the whole city, census tracts over Manhattan.
+    """
+    from utils.geocoding import RasterIndex, file_digest
+
+    if name not in _raster_indices:
+        if name == "taxi_zone":
+            index = get_taxi_zone_index()
+            sources = [TAXI_ZONES_PATH]
+            extent = tuple(index.bounds[:, :2].min(axis=0)) + tuple(
+                index.bounds[:, 2:].max(axis=0)
+            )
+        elif name == "census_tract":
+            index = get_census_tract_index()
+            sources = [CENSUS_TRACTS_PATH, BOROUGH_BOUNDARIES_PATH]
+            extent = get_borough_polygons()["Manhattan"].bounds
+        else:
+            raise ValueError("ERROR: Unknown raster lookup grid: {}".format(name))
+
+        raster_path = os.path.join(
+            SUPPLEMENTARY_DATA_ROOT, "{}_raster.npz".format(name)
+        )
+        digest = file_digest(*sources)
+
+        raster = None
+        if os.path.exists(raster_path):
+            raster = RasterIndex.load(raster_path, index, digest, RASTER_CELL_SIZE)
+        if raster is None:
+            print("[INFO] Building raster lookup grid: {}".format(raster_path))
+            raster = RasterIndex.build(index, extent, RASTER_CELL_SIZE)
+            raster.save(raster_path, digest)
+        _raster_indices[name] = raster
+
+    return _raster_indices[name]
+
+
+def get_numba_index(name):
+    """Returns the JIT-compiled lookup index of a geometry set in `_polygon_indices`"""
+    from utils.numba_geocoding import NumbaPolygonIndex
+
+    if name not in _numba_indices:
+        index = _polygon_indices[name]()
+        _numba_indices[name] = NumbaPolygonIndex(
+            dict(zip(index.keys, index.polygons)), index.bounds
+        )
+    return _numba_indices[name]
+
+
+def get_lookup_index(name, backend="index"):
+    """Returns the lookup index of a geometry set for a backend
+
+    Args:
+        name: str
+            One of `taxi_zone`, `borough`, `manhattan` and `census_tract`.
+        backend: str
+            `index` for the shapely `PolygonIndex`, `raster` for the raster lookup
+            grid (taxi zones and census tracts only) or `numba` for the
+            JIT-compiled ray casting kernel.
+    """
+    if backend == "index":
+        return _polygon_indices[name]()
+    elif backend == "raster":
+        return get_raster_index(name)
+    elif backend == "numba":
+        return get_numba_index(name)
+    raise ValueError("ERROR: Unknown lookup backend: {}".format(backend))
+
+
+def _batch_lookup(index, df, longitude_header, latitude_header, default=None):
+    """Looks up the polygon key of every row of a dataframe in a lookup index"""
+    keys = index.lookup(
+        df[longitude_header].to_numpy(), df[latitude_header].to_numpy(), default
+    )
+    return pd.Series(keys, index=df.index)
 
 
 def coordinate_to_zone(coords):
     """Converts a (long, lat) to Taxi Zone ID"""
     point = Point(*coords)
-    for zone_id, poly in taxi_zone_polygons.items():
+    for zone_id, poly in get_taxi_zone_polygons().items():
         if poly.contains(point):
             return zone_id
     return 0
 
 
 def batch_coordinate_to_zone(
-    df, longitude_header="pickup_longitude", latitude_header="pickup_latitude"
+    df,
+    longitude_header="pickup_longitude",
+    latitude_header="pickup_latitude",
+    backend="index",
 ):
-    """Converts a dataframe with longitudes and latitudes to a Series of Taxi Zone ID"""
-    return df.apply(
-        lambda row: coordinate_to_zone((row[longitude_header], row[latitude_header])),
-        axis=1,
-    )
+    """Converts a dataframe with longitudes and latitudes to a Series of Taxi Zone ID
+
+    See `get_lookup_index` for the available backends.
+    """
+    index = get_lookup_index("taxi_zone", backend)
+    return _batch_lookup(index, df, longitude_header, latitude_header, 0)
 
 
 def coordinate_to_borough(coords):
     """Converts a (long, lat) to borough name"""
     point = Point(*coords)
-    for boro_name, poly in borough_polygons.items():
+    for boro_name, poly in get_borough_polygons().items():
         if poly.contains(point):
             return boro_name
     return ""
 
 
 def batch_coordinate_to_borough(
-    df, longitude_header="pickup_longitude", latitude_header="pickup_latitude"
+    df,
+    longitude_header="pickup_longitude",
+    latitude_header="pickup_latitude",
+    backend="index",
 ):
-    """Converts a dataframe with longitudes and latitudes to a Series of borough names"""
-    return df.apply(
-        lambda row: coordinate_to_borough(
-            (row[longitude_header], row[latitude_header])
-        ),
-        axis=1,
-    )
+    """Converts a dataframe with longitudes and latitudes to a Series of borough names
+
+    See `get_lookup_index` for the available backends.
+    """
+    index = get_lookup_index("borough", backend)
+    return _batch_lookup(index, df, longitude_header, latitude_header, "")
 
 
 def coordinate_in_manhattan(coords):
     """Check if a (long, lat) is in Manhattan"""
     point = Point(*coords)
-    poly = borough_polygons["Manhattan"]
+    poly = get_borough_polygons()["Manhattan"]
     if poly.contains(point):
         return True
     return False
 
 
 def batch_coordinate_in_manhattan(
-    df, longitude_header="pickup_longitude", latitude_header="pickup_latitude"
+    df,
+    longitude_header="pickup_longitude",
+    latitude_header="pickup_latitude",
+    backend="index",
 ):
-    """Check if a batch of (long, lat) coordinates are in Manhattan"""
-    return df.apply(
-        lambda row: coordinate_in_manhattan(
-            (row[longitude_header], row[latitude_header])
-        ),
-        axis=1,
+    """Check if a batch of (long, lat) coordinates are in Manhattan
+
+    See `get_lookup_index` for the available backends.
+    """
+    positions = get_lookup_index("manhattan", backend).query(
+        df[longitude_header].to_numpy(), df[latitude_header].to_numpy()
     )
+    return pd.Series(positions >= 0, index=df.index)
 
 
 def coordinate_to_census_tract(coords):
     """Converts a (long, lat) to Census Tract Index"""
     point = Point(*coords)
-    for census_track_idx, poly in census_tract_polygons.items():
+    for census_track_idx, poly in get_census_tract_polygons().items():
         if poly.contains(point):
             return census_track_idx
     return -1
 
 
 def batch_coordinate_to_census_tract(
-    df, longitude_header="pickup_longitude", latitude_header="pickup_latitude"
+    df,
+    longitude_header="pickup_longitude",
+    latitude_header="pickup_latitude",
+    backend="index",
 ):
-    """Converts a dataframe with longitudes and latitudes to a Series of Census Tract Index"""
-    return df.apply(
-        lambda row: coordinate_to_census_tract(
-            (row[longitude_header], row[latitude_header])
-        ),
-        axis=1,
+    """Converts a dataframe with longitudes and latitudes to a Series of Census Tract Index
+
+    See `get_lookup_index` for the available backends.
+    """
+    index = get_lookup_index("census_tract", backend)
+    return _batch_lookup(index, df, longitude_header, latitude_header, -1)
+
+
+def get_borough_sub_indices(backend="index"):
+    """Returns spatial indices of the taxi zones and census tracts intersecting
+    each borough: {borough_name: (zone_index, tract_index)}
+
+    The entry of the empty borough name holds the indices of all zones and
+    tracts, for points outside every borough. Sub-indices keep the order of
+    the full indices, so lookups still return the first matching polygon.
+    """
+    if backend == "index":
+        from utils.geocoding import PolygonIndex as index_class
+    elif backend == "numba":
+        from utils.numba_geocoding import NumbaPolygonIndex as index_class
+    else:
+        raise ValueError("ERROR: Unknown hierarchical backend: {}".format(backend))
+
+    if backend not in _borough_sub_indices:
+        zone_index = get_taxi_zone_index()
+        tract_index = get_census_tract_index()
+        tract_positions = {tract_idx: i for i, tract_idx in enumerate(tract_index.keys)}
+
+        def sub_index(index, positions):
+            positions = np.sort(positions).astype(np.int64)
+            return index_class(
+                {index.keys[i]: index.polygons[i] for i in positions},
+                index.bounds[positions],
+            )
+
+        sub_indices = {
+            "": (
+                get_lookup_index("taxi_zone", backend),
+                get_lookup_index("census_tract", backend),
+            )
+        }
+        for boro_name, poly in get_borough_polygons().items():
+            sub_indices[boro_name] = (
+                sub_index(zone_index, zone_index.intersecting(poly)),
+                sub_index(
+                    tract_index,
+                    [
+                        tract_positions[tract_idx]
+                        for tract_idx in get_borough_tract_membership()[boro_name]
+                    ],
+                ),
+            )
+        _borough_sub_indices[backend] = sub_indices
+
+    return _borough_sub_indices[backend]
+
+
+def batch_coordinate_to_labels(
+    df,
+    longitude_header="pickup_longitude",
+    latitude_header="pickup_latitude",
+    backend="index",
+    boroughs=None,
+):
+    """Converts a dataframe with longitudes and latitudes to a DataFrame with the
+    borough name, Taxi Zone ID and Census Tract Index of each row
+
+    The borough is resolved first, and only the zones and census tracts that
+    intersect it are searched afterwards. The labels are the same as the ones of
+    `batch_coordinate_to_borough`, `batch_coordinate_to_zone` and
+    `batch_coordinate_to_census_tract`. `backend` is either `index` or `numba`.
+    If `boroughs` is given, zones and census tracts are only resolved for points
+    in these boroughs, and other points get 0 and -1.
+    """
+    x = df[longitude_header].to_numpy(dtype=float)
+    y = df[latitude_header].to_numpy(dtype=float)
+    sub_indices = get_borough_sub_indices(backend)
+
+    point_boroughs = get_lookup_index("borough", backend).lookup(x, y, "")
+    zones = np.zeros(x.shape[0], dtype=np.int64)
+    tracts = np.full(x.shape[0], -1, dtype=np.int64)
+    for boro_name in np.unique(point_boroughs):
+        if boroughs is not None and boro_name not in boroughs:
+            continue
+        mask = point_boroughs == boro_name
+        zone_index, tract_index = sub_indices[boro_name]
+        zones[mask] = zone_index.lookup(x[mask], y[mask], 0)
+        tracts[mask] = tract_index.lookup(x[mask], y[mask], -1)
+
+    return pd.DataFrame(
+        {
+            "borough": point_boroughs.astype(object),
+            "zone": zones,
+            "census_tract": tracts,
+        },
+        index=df.index,
+    )
+
+
+@lazy_dataset
+def get_zone_tract_crosswalk():
+    """Returns the crosswalk of area-overlap weights between taxi zones and census
+    tracts as (weights, zone_ids, tract_ids).
+
+    `weights` is a sparse matrix of shape [len(tract_ids), len(zone_ids)] where
+    each column holds the share of a taxi zone's area (among the parts covered
+    by census tracts) that falls in each tract, so every column sums to 1 for
+    zones that overlap any tract. The crosswalk is saved to
+    `SUPPLEMENTARY_DATA_ROOT` and rebuilt whenever the contents of the taxi
+    zone or census tract CSVs change.
+    """
+    from scipy import sparse
+
+    from utils.geocoding import file_digest, save_npz
+
+    crosswalk_path = os.path.join(SUPPLEMENTARY_DATA_ROOT, "zone_tract_crosswalk.npz")
+    digest = file_digest(TAXI_ZONES_PATH, CENSUS_TRACTS_PATH)
+    zone_ids = get_taxi_zone_index().keys
+    tract_ids = get_census_tract_index().keys
+
+    data = None
+    if os.path.exists(crosswalk_path):
+        with np.load(crosswalk_path) as cache:
+            if str(cache["digest"]) == digest:
+                data = cache["weight"], cache["tract_pos"], cache["zone_pos"]
+
+    if data is None:
+        print("[INFO] Building zone tract crosswalk: {}".format(crosswalk_path))
+        tract_index = get_census_tract_index()
+        weights, tract_pos, zone_pos = [], [], []
+        for i, zone_poly in enumerate(get_taxi_zone_index().polygons):
+            if not zone_poly.is_valid:
+                zone_poly = zone_poly.buffer(0)
+            overlaps = [
+                (j, zone_poly.intersection(tract_index.polygons[j]).area)
+                for j in tract_index.intersecting(zone_poly)
+            ]
+            total_area = sum(area for _, area in overlaps)
+            for j, area in overlaps:
+                if area > 0:
+                    weights.append(area / total_area)
+                    tract_pos.append(j)
+                    zone_pos.append(i)
+
+        data = (
+            np.array(weights, dtype=float),
+            np.array(tract_pos, dtype=np.int64),
+            np.array(zone_pos, dtype=np.int64),
+        )
+        save_npz(
+            crosswalk_path,
+            digest=digest,
+            weight=data[0],
+            tract_pos=data[1],
+            zone_pos=data[2],
+        )
+
+    weight, tract_pos, zone_pos = data
+    weights = sparse.csr_matrix(
+        (weight, (tract_pos, zone_pos)), shape=(len(tract_ids), len(zone_ids))
     )
+    return weights, zone_ids, tract_ids
+
+
+def zone_counts_to_tract_counts(zone_counts):
+    """Spreads counts per taxi zone onto census tracts by area overlap
+
+    Args:
+        pd.Series
+            Counts indexed by taxi zone ID. Zones missing from the taxi zone
+            data (e.g. unknown zones) are ignored.
+    Return:
+        pd.Series
+            Estimated counts (`float`) indexed by census tract index.
+    """
+    weights, zone_ids, tract_ids = get_zone_tract_crosswalk()
+    zone_vector = zone_counts.reindex(zone_ids).fillna(0).to_numpy(dtype=float)
+    return pd.Series(weights @ zone_vector, index=tract_ids)
+
+
+def batch_zone_to_tract_counts(df, zone_header="pickup_zone"):
+    """Converts a dataframe with taxi zone IDs to estimated trip counts per census
+    tract, without geocoding any coordinates"""
+    return zone_counts_to_tract_counts(df[zone_header].value_counts())
 
 
 # def snap_point_to_roads(coords):
@@ -176,10 +667,43 @@ def batch_coordinate_to_census_tract(
 #     return np.array([snap_point_to_roads(coords) for coords in coords_list])
 
 
-def parallel_proc(df, func, n_cores=16):
+def preload_geocoding(backend="index"):
+    """Loads the geometry and spatial indices used by `batch_coordinate_to_labels`
+    so that forked worker processes inherit them instead of loading their own"""
+    get_lookup_index("borough", backend)
+    get_borough_sub_indices(backend)
+    get_borough_polygons()
+    get_taxi_zone_polygons()
+    get_census_tract_polygons()
+
+
+def _init_worker(preload):
+    """Pool initializer reporting the time a worker spends getting ready"""
+    start = time.perf_counter()
+    if preload is not None:
+        preload()
+    print(
+        "[DEBUG] Worker {} initialized in {:.3f}s.".format(
+            os.getpid(), time.perf_counter() - start
+        )
+    )
+
+
+def parallel_proc(df, func, n_cores=16, preload=None):
+    """Applies `func` to `n_cores` chunks of `df` in parallel and concatenates
+    the results.
+
+    `preload`, e.g. `preload_geocoding` when `func` geocodes, is called by
+    every worker on startup, which reports how long it took. With the fork
+    start method, it is also called once in the parent before the workers are
+    forked, so the datasets it loads are shared copy-on-write with every worker
+    rather than loaded again in each of them.
+    """
+    if preload is not None and get_start_method() == "fork":
+        preload()
     df_split = np.array_split(df, n_cores)
-    pool = Pool(n_cores)
-    df = pd.concat(pool.map(func, df_split))
+    with Pool(n_cores, initializer=_init_worker, initargs=(preload,)) as pool:
+        df = pd.concat(pool.map(func, df_split))
     return df
 
 